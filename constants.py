@@ -28,5 +28,30 @@ TGB_END_SCORE = 15
 
 SOCKET_EVENT_ENC_SEARCH_RESULT = "encyclopedia_search_result"
 
+# A round waits for players to act. If nobody acts for this many seconds, the
+# pending cards are sent out again (eg. for clients that missed them)
+ROUND_WAKEUP_TIMEOUT = 10
+
+# While waiting for players to join, a heartbeat is sent to the game every
+# this many seconds
+LOBBY_HEARTBEAT_INTERVAL = 5
+# A game which is still waiting for players this many seconds after it was
+# started (or loaded) is ended
+LOBBY_TIMEOUT = 30 * 60
+
+# A running game with no connected players for this many seconds is written
+# to the database and stopped. It is loaded again when it is next asked for
+HIBERNATE_AFTER = 10 * 60
+
+# about_game broadcasts only carry the fields that changed. A full snapshot is
+# sent if the last one is older than this many seconds
+ABOUT_FULL_SNAPSHOT_INTERVAL = 30
+
+# Imports from JSON insert this many rows per INSERT statement
+IMPORT_BATCH_SIZE = 100
+
 # Game creation retries
 GAME_CREATION_TOTAL_TRIES = 2
+
+# Random names tried for a new game before giving up
+GAME_NAME_TRIES = 1000
@@ -10,112 +10,45 @@ For the remaining 0.75, we have two choices :
 
 from exceptions import OutOfCards
 from models import Card, Player, Score
+from models.deck import TRUE_TOPICAL, TRUE_AFFINITY, FAKE_TOPICAL, FAKE_AFFINITY, BIAS
 import random
 from constants import TGB_END_SCORE
-from peewee import fn
 
 def clamp(x, minn, maxx):
    return x if x > minn and x < maxx else (minn if x < minn else maxx)
 
+# Each select function returns a tuple of (number of cards to pick from, card).
+# Cards are popped off the game's pre-shuffled deck - see models/deck.py
+
+
 def select_true_topical_card(player, tgb, yellow):
-    return (
-        Card.select()
-        .where(Card.game == player.game)
-        .where(Card.original_player == None)
-        .where(Card.affinity_towards == None)
-        .where(Card.bias_against == None)
-        .where(Card.fake == False)
-        .count(),
-        Card.select()
-        .where(Card.game == player.game)
-        .where(Card.original_player == None)
-        .where(Card.affinity_towards == None)
-        .where(Card.bias_against == None)
-        .where(Card.fake == False)
-        .order_by(fn.Rand())
-        .first()
-    )
+    deck = player.game.state.deck
+    return (deck.count(TRUE_TOPICAL), deck.draw(TRUE_TOPICAL))
 
 def select_true_affinity_card(player, tgb, yellow):
+    deck = player.game.state.deck
     return (
-        Card.select()
-        .where(Card.game == player.game)
-        .where(Card.original_player == None)
-        .where(Card.affinity_towards != None)
-        .where(Card.fake == False)
-        .where(Card.tgb <= tgb + 2)
-        .count(),
-        Card.select()
-        .where(Card.game == player.game)
-        .where(Card.original_player == None)
-        .where(Card.affinity_towards != None)
-        .where(Card.fake == False)
-        .where(Card.tgb <= tgb + 2)
-        .order_by(fn.Rand())
-        .first()
+        deck.count(TRUE_AFFINITY, max_tgb=tgb + 2),
+        deck.draw(TRUE_AFFINITY, max_tgb=tgb + 2),
     )
 
 def select_fake_topical_card(player, tgb, yellow):
-    return (
-        Card.select()
-        .where(Card.game == player.game)
-        .where(Card.original_player == None)
-        .where(Card.affinity_towards == None)
-        .where(Card.bias_against == None)
-        .where(Card.fake == True)
-        .where(Card.faked_by == None)
-        .count(),
-        Card.select()
-        .where(Card.game == player.game)
-        .where(Card.original_player == None)
-        .where(Card.affinity_towards == None)
-        .where(Card.bias_against == None)
-        .where(Card.fake == True)
-        .where(Card.faked_by == None)
-        .order_by(fn.Rand())
-        .first()
-    )
+    deck = player.game.state.deck
+    return (deck.count(FAKE_TOPICAL), deck.draw(FAKE_TOPICAL))
 
 def select_fake_affinity_card(player, tgb, yellow):
+    deck = player.game.state.deck
     return (
-        Card.select()
-        .where(Card.game == player.game)
-        .where(Card.original_player == None)
-        .where(Card.affinity_towards != None)
-        .where(Card.fake == True)
-        .where(Card.faked_by == None)
-        .where(Card.tgb <= tgb + 2)
-        .count(),
-        Card.select()
-        .where(Card.game == player.game)
-        .where(Card.original_player == None)
-        .where(Card.affinity_towards != None)
-        .where(Card.fake == True)
-        .where(Card.faked_by == None)
-        .where(Card.tgb <= tgb + 2)
-        .order_by(fn.Rand())
-        .first()
+        deck.count(FAKE_AFFINITY, max_tgb=tgb + 2),
+        deck.draw(FAKE_AFFINITY, max_tgb=tgb + 2),
     )
 
 def select_bias_card(player, tgb, yellow):
-    return(
-        Card.select()
-        .where(Card.game == player.game)
-        .where(Card.original_player == None)
-        .where(Card.bias_against != None)
-        .where(Card.bias_against != player.color)
-        .where(Card.bias_against != yellow)
-        .where(Card.tgb <= tgb + 2)
-        .count(),
-        Card.select()
-        .where(Card.game == player.game)
-        .where(Card.original_player == None)
-        .where(Card.bias_against != None)
-        .where(Card.bias_against != player.color)
-        .where(Card.bias_against != yellow)
-        .where(Card.tgb <= tgb + 2)
-        .order_by(fn.Rand())
-        .first()
+    deck = player.game.state.deck
+    exclude_colors = (player.color_id, yellow.id_)
+    return (
+        deck.count(BIAS, max_tgb=tgb + 2, exclude_colors=exclude_colors),
+        deck.draw(BIAS, max_tgb=tgb + 2, exclude_colors=exclude_colors),
     )
 
 def _select(player: Player):
@@ -127,12 +60,12 @@ def _select(player: Player):
         bias_p = random.uniform(0, 1)
         player_count_with_clout_more_than_two = len(
             [x for x in filter(lambda scores: scores['score']>2, 
-            [Score.all_scores_for_client(player.score_set) for player in player.game.player_set])])
+            [Score.all_scores_for_client(player) for player in player.game.state.players.values()])])
         shoud_draw_bias = bias_p < 0.3 and player_count_with_clout_more_than_two >= 1
 
 
         # temporary code to exclude drawing anti yellow card
-        yellow = [color for color in player.game.color_set if color.name=='yellow'][0]
+        yellow = [color for color in player.game.state.colors if color.name=='yellow'][0]
 
         print('\t\tdrawing card')
         if shoud_draw_bias:
@@ -183,7 +116,7 @@ def select(player: Player):
         bias_p = random.uniform(0, 1)
         
         # temporary code to exclude drawing anti yellow card
-        yellow = [color for color in player.game.color_set if color.name=='yellow'][0]
+        yellow = [color for color in player.game.state.colors if color.name=='yellow'][0]
 
         print('\t\tdrawing card')
         if bias_p <= 0.2:
@@ -0,0 +1,204 @@
+"""Admission control for running games
+
+A worker only starts as many games as it can run. What a running game costs
+is measured while it runs - the CPU time and the number of queries of its
+main loop and of the requests about it - as rates per second which decay
+over ADMISSION_WINDOW seconds. A game is started only if the games already
+running plus one more game of average cost fit into the budgets. Otherwise
+the request fails right away with `Overloaded` - it doesn't wait for room,
+which would hold one of the threads handling requests - and the client
+retries later.
+
+CPU time is measured with time.thread_time around a game's work - the CPU
+time of the thread doing it, so background threads (eg. the audit log
+writer) aren't billed to games. Under asyncio (main_loop/asgi.py) every
+game loop and request runs in a thread of its own and is measured exactly.
+Under eventlet all greenlets share one thread, so a game is also billed for
+whatever other greenlets ran while its work waited on the database: the
+figures add up to more than the worker really uses, which errs on the side
+of admitting fewer games. They are meant to tell busy games from idle ones,
+not to bill them.
+
+Configured with environment variables:
+
+- MAX_GAMES - number of games a worker runs at most (default 3)
+- ADMISSION_CPU_BUDGET - CPU seconds per second all games may use together
+  (default 0.8 - a worker runs on a single core)
+- ADMISSION_QUERY_BUDGET - queries per second all games may run together
+  (default 200)
+"""
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from models import db
+
+MAX_GAMES = int(os.getenv("MAX_GAMES", "3"))
+ADMISSION_CPU_BUDGET = float(os.getenv("ADMISSION_CPU_BUDGET", "0.8"))
+ADMISSION_QUERY_BUDGET = float(os.getenv("ADMISSION_QUERY_BUDGET", "200"))
+# Seconds over which a game's cost is averaged
+ADMISSION_WINDOW = 60
+# What a game is assumed to cost while no game has been measured yet
+DEFAULT_GAME_CPU = 0.02
+DEFAULT_GAME_QUERIES = 5
+
+
+class Overloaded(Exception):
+    """No room for another game on this worker"""
+
+    def __init__(self, status: dict):
+        self.status = status
+        super().__init__("Too many games running on this worker, try again later")
+
+
+class DecayingRate:
+    """Amount per second, exponentially averaged over `window` seconds"""
+
+    def __init__(self, window: float = ADMISSION_WINDOW):
+        self.window = window
+        self.total = 0.0
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _decay(self):
+        now = time.monotonic()
+        self.total *= math.exp(-(now - self.updated) / self.window)
+        self.updated = now
+
+    def add(self, amount: float):
+        with self.lock:
+            self._decay()
+            self.total += amount
+
+    def rate(self) -> float:
+        with self.lock:
+            self._decay()
+            return self.total / self.window
+
+
+class GameMeter:
+    """Live cost of one game"""
+
+    def __init__(self):
+        self.cpu = DecayingRate()
+        self.query_rate = DecayingRate()
+        self.queries = 0  # Counted by db.count_queries
+
+    @contextmanager
+    def measure(self):
+        """Adds the CPU time and queries of the block to this game's cost"""
+        start = time.thread_time()
+        queries = self.queries
+        try:
+            with db.count_queries(self):
+                yield
+        finally:
+            self.cpu.add(time.thread_time() - start)
+            self.query_rate.add(self.queries - queries)
+
+    def to_dict(self) -> dict:
+        return {"cpu": self.cpu.rate(), "queries": self.query_rate.rate()}
+
+
+class AdmissionController:
+    """Decides whether this worker starts another game. Safe to use from
+    several threads"""
+
+    def __init__(
+        self,
+        max_games: int = MAX_GAMES,
+        cpu_budget: float = ADMISSION_CPU_BUDGET,
+        query_budget: float = ADMISSION_QUERY_BUDGET,
+    ):
+        self.max_games = max_games
+        self.cpu_budget = cpu_budget
+        self.query_budget = query_budget
+        self.meters = {}  # game name -> GameMeter of running games
+        # Games admitted but not started yet (eg. still being created)
+        self.reserved = 0
+        self.lock = threading.RLock()
+
+    # Running games
+
+    def meter(self, name: str) -> GameMeter:
+        """Meter of a game. Games are counted as running once metered"""
+        with self.lock:
+            if name not in self.meters:
+                self.meters[name] = GameMeter()
+            return self.meters[name]
+
+    def start(self, name: str, reserved: bool = False) -> GameMeter:
+        """Records that a game started. `reserved` if it was admitted with
+        `admit` beforehand"""
+        with self.lock:
+            if reserved:
+                self.cancel()
+            return self.meter(name)
+
+    def stop(self, name: str):
+        with self.lock:
+            self.meters.pop(name, None)
+
+    # Admission
+
+    def usage(self):
+        """CPU and queries per second of all running games"""
+        with self.lock:
+            meters = list(self.meters.values())
+        return (
+            sum(meter.cpu.rate() for meter in meters),
+            sum(meter.query_rate.rate() for meter in meters),
+        )
+
+    def estimate(self):
+        """Expected CPU and queries per second of another game - the average
+        of the running games"""
+        with self.lock:
+            if not self.meters:
+                return DEFAULT_GAME_CPU, DEFAULT_GAME_QUERIES
+            cpu, queries = self.usage()
+            return cpu / len(self.meters), queries / len(self.meters)
+
+    def has_capacity(self) -> bool:
+        with self.lock:
+            running = len(self.meters) + self.reserved
+            if running >= self.max_games:
+                return False
+            if not running:
+                # A single game is always let in, whatever it is expected to cost
+                return True
+            cpu, queries = self.usage()
+            game_cpu, game_queries = self.estimate()
+            return (
+                cpu + game_cpu <= self.cpu_budget
+                and queries + game_queries <= self.query_budget
+            )
+
+    def admit(self):
+        """Reserves room for another game, or raises Overloaded if there is
+        none. The reservation is used by `start` or given back with `cancel`"""
+        with self.lock:
+            if not self.has_capacity():
+                raise Overloaded(self.status())
+            self.reserved += 1
+
+    def cancel(self):
+        """Gives back a reservation"""
+        with self.lock:
+            self.reserved = max(self.reserved - 1, 0)
+
+    def status(self) -> dict:
+        with self.lock:
+            cpu, queries = self.usage()
+            return {
+                "games": len(self.meters),
+                "reserved": self.reserved,
+                "max_games": self.max_games,
+                "cpu": cpu,
+                "cpu_budget": self.cpu_budget,
+                "queries": queries,
+                "query_budget": self.query_budget,
+                "accepting": self.has_capacity(),
+            }
@@ -0,0 +1,148 @@
+"""asyncio entry point
+
+Runs the socket handlers of main_loop/websocket.py on a python-socketio
+AsyncServer under uvicorn, instead of on eventlet. The handlers and the game
+loops are unchanged and still block on peewee, so they don't run on the event
+loop:
+
+- every socket event is handled in a bounded pool of ASGI_DB_THREADS threads
+  (default 10 - keep it below DB_MAX_CONNECTIONS)
+- every game loop runs in a thread of its own. MAX_GAMES bounds how many
+- a game's loop and the requests about it take turns on the game's lock
+  (GameRunner.lock_for), since they share its in-memory state
+
+The Flask-SocketIO object the handlers talk to (emit, join_room, ...) is
+pointed at `ServerBridge`, which runs those calls on the AsyncServer in the
+event loop. The Flask routes (eg. /health) are served as a WSGI app.
+
+Run from the repo root (after `source activate_env.sh`):
+
+    python main_loop/asgi.py
+
+or `uvicorn main_loop.asgi:asgi_app`, with PORT, WORKER_ID etc. set just as
+for main_loop/websocket.py.
+"""
+import os
+
+# Must be set before the handlers are imported - they are run in threads
+# here, so eventlet must not patch anything
+os.environ["ASYNC_MODE"] = "threading"
+
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import socketio
+from uvicorn.middleware.wsgi import WSGIMiddleware
+
+from main_loop import cluster
+from main_loop.websocket import app, socketio as flask_socketio
+
+ASGI_DB_THREADS = int(os.getenv("ASGI_DB_THREADS", "10"))
+
+
+class ServerBridge:
+    """Stands in for the socketio.Server behind Flask-SocketIO. Calls made
+    from handler and game loop threads are run on the AsyncServer in the
+    event loop, and wait for it"""
+
+    async_mode = "asgi"
+
+    def __init__(self, server: socketio.AsyncServer):
+        self.server = server
+        self.loop = None  # Set when the app starts up
+
+    def _run(self, coro):
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self.loop:
+            # Called on the event loop itself (eg. an emit callback)
+            return self.loop.create_task(coro)
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def emit(self, event, data=None, to=None, room=None, skip_sid=None,
+             namespace=None, callback=None, **kwargs):
+        return self._run(
+            self.server.emit(
+                event, data, to=to or room, skip_sid=skip_sid,
+                namespace=namespace, callback=callback, **kwargs,
+            )
+        )
+
+    def send(self, data, **kwargs):
+        return self.emit("message", data, **kwargs)
+
+    def enter_room(self, sid, room, namespace=None):
+        return self._run(self.server.enter_room(sid, room, namespace=namespace))
+
+    def leave_room(self, sid, room, namespace=None):
+        return self._run(self.server.leave_room(sid, room, namespace=namespace))
+
+    def close_room(self, room, namespace=None):
+        return self._run(self.server.close_room(room, namespace=namespace))
+
+    def rooms(self, sid, namespace=None):
+        return self.server.rooms(sid, namespace=namespace)
+
+    def disconnect(self, sid, namespace=None, **kwargs):
+        return self._run(self.server.disconnect(sid, namespace=namespace))
+
+    def get_environ(self, sid, namespace=None):
+        return self.server.get_environ(sid, namespace=namespace)
+
+    def start_background_task(self, target, *args, **kwargs):
+        thread = threading.Thread(target=target, args=args, kwargs=kwargs, daemon=True)
+        thread.start()
+        return thread
+
+    def sleep(self, seconds=0):
+        time.sleep(seconds)
+
+
+sio = socketio.AsyncServer(
+    async_mode="asgi",
+    cors_allowed_origins="*",
+    client_manager=cluster.async_client_manager(),
+)
+bridge = ServerBridge(sio)
+executor = ThreadPoolExecutor(max_workers=ASGI_DB_THREADS, thread_name_prefix="handler")
+
+
+def register(event: str, handler):
+    """Handles `event` with Flask-SocketIO's handler for it, in the pool"""
+
+    async def handle(sid, *args):
+        if event == "connect":
+            # Flask-SocketIO finds the app through the environ
+            args[0]["flask.app"] = app
+        return await bridge.loop.run_in_executor(executor, handler, sid, *args)
+
+    sio.on(event, handle)
+
+
+# Flask-SocketIO registered the handlers on its own (unused) server
+for event, handler in flask_socketio.server.handlers["/"].items():
+    register(event, handler)
+flask_socketio.server = bridge
+
+
+async def startup():
+    bridge.loop = asyncio.get_running_loop()
+
+
+asgi_app = socketio.ASGIApp(
+    sio, other_asgi_app=WSGIMiddleware(app), on_startup=startup
+)
+
+
+def run():
+    import uvicorn
+
+    uvicorn.run(asgi_app, host="0.0.0.0", port=int(os.getenv("PORT", "5000")))
+
+
+if __name__ == "__main__":
+    run()
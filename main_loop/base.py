@@ -2,17 +2,61 @@
 
 import logging
 import sys
+import time
+from contextlib import contextmanager, nullcontext
 from abc import ABC, abstractmethod
+from threading import Event, Lock, RLock
+from weakref import WeakValueDictionary
 from typing import Callable
-from models import db, Game, Player, CardInstance, CancelStatus, CancelVote, FullRound
-from constants import CANCELLING_ALLOW_POLL
+from models import (
+    db,
+    Game,
+    GameState,
+    Player,
+    CardInstance,
+    CancelStatus,
+    CancelVote,
+    FullRound,
+    power_log,
+)
+from constants import (
+    CANCELLING_ALLOW_POLL,
+    HIBERNATE_AFTER,
+    LOBBY_HEARTBEAT_INTERVAL,
+    LOBBY_TIMEOUT,
+    ROUND_WAKEUP_TIMEOUT,
+)
+from models.messages import HEARTBEAT
+
+
+class Hibernated(Exception):
+    """Raised in the main loop to stop it once its game was hibernated"""
 
 
 class GameRunner(ABC):
+    # Game name -> lock around everything done to that game's state, by its
+    # main loop and by requests about it. Kept by name so that a game loaded
+    # again gets the same lock, for as long as anybody holds on to it
+    _locks = WeakValueDictionary()
+    _locks_lock = Lock()
+
     def __init__(self, game: Game, socketio=None, logger: logging.Logger = None):
         self.game = game
         self.socketio = socketio
         game.runner = self
+        self.lock = self.lock_for(game.name)
+        # The runner owns the game's state - writes are buffered and flushed
+        # by the runner
+        self.state = game.state
+        self.state.write_behind = True
+        # The runner saves its game every round, so the state has to update
+        # this copy of the game (eg. its tgb counter)
+        self.state.game = game
+        game.tgb = self.state.tgb
+        # Set whenever something happens that the main loop should react to
+        self.wakeup = Event()
+        # Last time a player was connected or the game was asked for
+        self.last_active = time.monotonic()
         self.default_log_formatter = logging.Formatter(
             f"{self.name} : %(asctime)s - %(name)s - %(levelname)s - %(message)s"
         )
@@ -32,7 +76,71 @@ class GameRunner(ABC):
 
     @property
     def players(self):
-        return Player.select().where(Player.game == self.game)
+        return self.state.ordered_players()
+
+    @classmethod
+    def lock_for(cls, name: str) -> RLock:
+        """The lock of the game called `name`. The main loop holds it while
+        it works on the game (but not while it waits for players), and
+        requests about the game should hold it too"""
+        with cls._locks_lock:
+            lock = cls._locks.get(name)
+            if lock is None:
+                lock = cls._locks[name] = RLock()
+            return lock
+
+    def measure(self):
+        """Context manager which counts the block towards the cost of this
+        game (see main_loop/admission.py). Does nothing by default"""
+        return nullcontext()
+
+    @contextmanager
+    def working(self):
+        """Holds the game's lock and measures the block"""
+        with self.lock, self.measure():
+            yield
+
+    def notify(self):
+        """Wakes up the main loop. Call this whenever a player acts or
+        (re)joins"""
+        self.touch()
+        self.wakeup.set()
+
+    def touch(self):
+        """Records that the game is in use"""
+        self.last_active = time.monotonic()
+
+    def connected(self) -> bool:
+        """Whether any player of the game is connected right now"""
+        return any(player.client_id for player in self.state.players.values())
+
+    def idle(self) -> bool:
+        """Whether no player has been connected for HIBERNATE_AFTER seconds"""
+        if self.connected():
+            self.touch()
+            return False
+        return time.monotonic() - self.last_active > HIBERNATE_AFTER
+
+    def hibernate_if_idle(self):
+        """Writes an idle game to the database, forgets its state and stops
+        the main loop by raising Hibernated. The game is picked up from the
+        database again the next time it is asked for"""
+        if not self.idle():
+            return
+        with self.lock:
+            with db:
+                self.state.flush()
+                self.game.save()
+                power_log.flush()
+            # Somebody may have come back while the game was being written
+            if self.idle():
+                self.forget()
+                raise Hibernated()
+
+    def forget(self):
+        """Drops everything held in memory for this game. Must not wait on
+        anything, so that no request sees a half forgotten game"""
+        GameState.unload(self.game)
 
     def invoke_player_action(self, player: Player, card_instance: CardInstance):
         """If this is a synchronous game runner - like a console based, ask the
@@ -47,39 +155,58 @@ class GameRunner(ABC):
     def finish_round(self, drawing_player: Player):
         """Invokes actions and waits until no cards are queued"""
         # If this player is pending cancellation punishment then skip them
-        if CancelStatus.cancelled(drawing_player):
-            print(str(drawing_player) + " was cancelled")
-            # update the sequence of players regardless of the player being cancelled for the turn order to be maintained
-            Player.update(sequence=Player.sequence + 100, current=True).where( 
-                Player.id_ == drawing_player.id_ 
-            ).execute()
-            return False
+        with self.working():
+            if CancelStatus.cancelled(drawing_player):
+                print(str(drawing_player) + " was cancelled")
+                # update the sequence of players regardless of the player being cancelled for the turn order to be maintained
+                self.state.set_current(drawing_player.id_, exclusive=False)
+                self.state.flush()
+                return False
 
+        changed = True
         while True:
-            # First send out the heartbeat
-            # self.game.heartbeat()
-
-            # logging.info("doing round")
-            self.game.update_powers()
-            if not self.game.active():
-                self.logger.info("Game has ended")
-                return False # See if False is indeed needed for game end (needs to be checked)
-            # self.logger.info("Looping")
-            done = True
-            with db:
-                for player in self.players.iterator():
-                    # TODO see if you can optimise this in a single query
-                    if (card_instance := player.get_queued_card_instance()) is not None:
-                        self.invoke_player_action(player, card_instance)
-                        done = False
-                    if ((pending_vote := player.get_pending_cancel_vote()) is not None) and CANCELLING_ALLOW_POLL:
-                        self.invoke_vote(player, pending_vote)
-                        done = False
-                    # TODO see if you really need to update powers after each turn
-                    # self.game.update_powers()
+            with self.working():
+                # First send out the heartbeat
+                # self.game.heartbeat()
+
+                # Anything that happens from here on wakes up the wait below
+                self.wakeup.clear()
+                # logging.info("doing round")
+                # Scores only change when somebody acts. If we woke up because
+                # of the timeout, only the pending cards are sent out again
+                if changed:
+                    self.game.update_powers()
+                    with db:
+                        self.state.flush()
+                    if not self.game.active():
+                        self.logger.info("Game has ended")
+                        return False # See if False is indeed needed for game end (needs to be checked)
+                # self.logger.info("Looping")
+                done = True
+                with db:
+                    # Queued cards come from the game state. Pending votes of all
+                    # players are read in one go
+                    pending_votes = (
+                        CancelVote.pending_by_voter(self.game)
+                        if CANCELLING_ALLOW_POLL
+                        else {}
+                    )
+                    for player in self.players:
+                        if (card_instance := self.state.queue_head(player.id_)) is not None:
+                            self.invoke_player_action(player, card_instance)
+                            done = False
+                        if (pending_vote := pending_votes.get(player.id_)) is not None:
+                            self.invoke_vote(player, pending_vote)
+                            done = False
+                        # TODO see if you really need to update powers after each turn
+                        # self.game.update_powers()
             if done:
                 break
-            self.socketio.sleep(1)
+            # Don't hold on to a connection while the players think
+            db.release()
+            changed = self.wakeup.wait(timeout=ROUND_WAKEUP_TIMEOUT)
+            if not changed:
+                self.hibernate_if_idle()
         
         return True
 
@@ -90,41 +217,66 @@ class GameRunner(ABC):
         # if yes, then they will get a turn and the game will wait till that player takes an action with it
         # this card instance is assigned at the previous round when the below code runs
         if flag:
-            with db:
+            with self.working(), db:
                 card_instance = self.game.draw(drawing_player, full_round=full_round)
                 if not card_instance:
                     raise Exception("Out of cards!")
+                self.state.flush()
             self.finish_round(drawing_player)
 
     def exit(self):
         """Run any exit operations if you want"""
         pass
 
+    def wait_for_players(self) -> bool:
+        """Waits till all players joined. The lobby is woken up by players
+        joining - only then is what changed broadcast. In between a cached
+        heartbeat is sent every LOBBY_HEARTBEAT_INTERVAL seconds.
+
+        Returns False if not all players joined within LOBBY_TIMEOUT"""
+        deadline = time.monotonic() + LOBBY_TIMEOUT
+        changed = True
+        while True:
+            with self.working():
+                # Anything that happens from here on wakes up the wait below
+                self.wakeup.clear()
+                if changed:
+                    self.game.heartbeat()
+                if self.game.ended or self.game.started():
+                    return True
+                if not changed:
+                    self.send_to_game(
+                        self.game, self.state.heartbeat_payload(), HEARTBEAT.name
+                    )
+            if time.monotonic() >= deadline:
+                return False
+            db.release()
+            changed = self.wakeup.wait(timeout=LOBBY_HEARTBEAT_INTERVAL)
+            if not changed:
+                self.hibernate_if_idle()
+
     def loop(self):
-        while self.game.active() and not self.game.started():
-            # All players have not joined
-            self.socketio.sleep(1)
-            # Send the heartbeat
-            self.game.heartbeat()
-            # TODO add a timeout of 5 minutes
-            continue
-
-        while self.game.active():
-            with db:
-                idx = 0
-                full_round = FullRound.create(game=self.game)
-                players = [player for player in self.players]
-                ordered_players = sorted(players, key=lambda player: player.sequence)
-                
-            for player in ordered_players:
-                # Re fetch the player once
-                player = self.players.select().where(Player.id_ == player.id_).first()
-                self.do_round(player, full_round)
-                # if idx == 10:
-                #     self.game.save()
-                #     idx = 0
-                # idx += 1
-                self.game.save()
+        try:
+            if not self.wait_for_players():
+                self.logger.info("Not all players joined in time, ending the game")
+            else:
+                while self.game.active():
+                    with self.working(), db:
+                        idx = 0
+                        full_round = FullRound.create(game=self.game)
+                        ordered_players = self.players
+
+                    for player in ordered_players:
+                        self.do_round(player, full_round)
+                        # if idx == 10:
+                        #     self.game.save()
+                        #     idx = 0
+                        # idx += 1
+                        with self.lock:
+                            self.game.save()
+        except Hibernated:
+            self.logger.info("No players connected, hibernating")
+            return
 
         self.exit()
 
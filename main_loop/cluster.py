@@ -0,0 +1,134 @@
+"""Running several websocket workers
+
+Every game is run by exactly one worker - its main loop and its GameState
+live in that worker's memory. The worker is picked by hashing the game name
+onto a ring of workers (consistent hashing), so every worker agrees on the
+owner of a game without asking anyone, and adding or removing a worker only
+moves the games of one slice of the ring.
+
+Requests for a game that reach another worker are answered with the address
+of the owner, which the client reconnects to. Emits go through a message
+queue shared by all workers, so any worker can emit to any client or game
+room.
+
+Configured with environment variables:
+
+- WORKERS - comma separated addresses of all workers (eg.
+  `http://host:5001,http://host:5002`). Unset means a single worker which
+  owns every game
+- WORKER_ID - the address of this worker, one of WORKERS. A worker
+  refuses to start if it isn't
+- MESSAGE_QUEUE - url of the message queue shared by the workers (eg.
+  `redis://localhost:6379/0`), or `local` for the in-process stand-in
+"""
+import bisect
+import hashlib
+import os
+from queue import Queue
+
+import socketio
+
+# Points per worker on the ring. More points spread games more evenly
+RING_REPLICAS = 100
+
+
+def _hash(key: str) -> int:
+    return int(hashlib.md5(key.encode()).hexdigest()[:16], 16)
+
+
+class HashRing:
+    """Consistent hash ring mapping game names to workers"""
+
+    def __init__(self, workers, replicas: int = RING_REPLICAS):
+        self.workers = list(workers)
+        points = sorted(
+            (_hash(f"{worker}#{idx}"), worker)
+            for worker in self.workers
+            for idx in range(replicas)
+        )
+        self._hashes = [point for point, _ in points]
+        self._workers = [worker for _, worker in points]
+
+    def owner(self, name: str):
+        """Returns the worker owning `name`, or None if there are no workers"""
+        if not self._hashes:
+            return None
+        idx = bisect.bisect(self._hashes, _hash(name)) % len(self._hashes)
+        return self._workers[idx]
+
+
+WORKERS = [worker.strip() for worker in os.getenv("WORKERS", "").split(",") if worker.strip()]
+WORKER_ID = os.getenv("WORKER_ID")
+MESSAGE_QUEUE = os.getenv("MESSAGE_QUEUE")
+
+
+
+def check_config(workers=WORKERS, worker_id=WORKER_ID):
+    """Raises ValueError if this worker can't own any game - it would
+    redirect every request and never find a name for a new game"""
+    if workers and worker_id not in workers:
+        raise ValueError(
+            f"WORKER_ID {worker_id!r} is not one of WORKERS {', '.join(workers)}"
+        )
+
+
+check_config()
+ring = HashRing(WORKERS)
+
+
+def owner(game_name: str):
+    """Address of the worker running `game_name`. None on a single worker"""
+    return ring.owner(game_name)
+
+
+def owns(game_name: str) -> bool:
+    """Whether this worker runs `game_name`"""
+    return not WORKERS or owner(game_name) == WORKER_ID
+
+
+class LocalManager(socketio.PubSubManager):
+    """In-process stand-in for a message queue. All servers of a process
+    which use the same channel see each other's messages, just like separate
+    workers sharing a redis - so tests can run several servers without a
+    broker"""
+
+    name = "local"
+    # channel -> queues of the subscribed managers
+    channels = {}
+
+    def __init__(self, channel="socketio", write_only=False, logger=None, json=None):
+        super().__init__(
+            channel=channel, write_only=write_only, logger=logger, json=json
+        )
+        self.queue = Queue()
+        if not write_only:
+            self.channels.setdefault(channel, []).append(self.queue)
+
+    def _publish(self, data):
+        for queue in self.channels.get(self.channel, []):
+            queue.put(data)
+
+    def _listen(self):
+        while True:
+            yield self.queue.get()
+
+
+def socketio_options() -> dict:
+    """Keyword arguments for SocketIO which connect it to the message
+    queue, if one is configured"""
+    if not MESSAGE_QUEUE:
+        return {}
+    if MESSAGE_QUEUE == "local":
+        return {"client_manager": LocalManager(channel="flask-socketio")}
+    return {"message_queue": MESSAGE_QUEUE}
+
+
+def async_client_manager():
+    """Client manager for a socketio.AsyncServer which connects it to the
+    message queue, or None. Only redis is supported there"""
+    if not MESSAGE_QUEUE or MESSAGE_QUEUE == "local":
+        return None
+    if not MESSAGE_QUEUE.startswith(("redis://", "rediss://")):
+        raise ValueError(f"Unsupported message queue under asyncio: {MESSAGE_QUEUE}")
+    # Same channel as flask-socketio, so both kinds of workers can be mixed
+    return socketio.AsyncRedisManager(MESSAGE_QUEUE, channel="flask-socketio")
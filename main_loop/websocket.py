@@ -1,16 +1,23 @@
-import eventlet
+import os
+
+# Set ASYNC_MODE to "threading" to run these handlers in plain threads - the
+# asyncio entry point (main_loop/asgi.py) does. Anything else runs them on
+# eventlet
+ASYNC_MODE = os.getenv("ASYNC_MODE")
+if ASYNC_MODE != "threading":
+    import eventlet
 
-eventlet.monkey_patch()
+    eventlet.monkey_patch()
 import logging
 import inspect
 import json
 import sys
-import os
 import pickle
+from contextlib import nullcontext
 from functools import wraps
 from datetime import datetime, timezone
 from queue import Queue
-from threading import Lock, Thread
+from threading import Lock, RLock, Thread
 from flask import Flask, render_template, session, request, copy_current_request_context
 from flask_socketio import (
     SocketIO,
@@ -28,20 +35,22 @@ import sys
 from models import Score
 
 from constants import GAME_CREATION_TOTAL_TRIES
-from models import Game, Player, Card, CardInstance, CancelVote, FullRound, db
+from models import Game, Player, Card, CardInstance, CancelVote, FullRound, GameState, db, power_log
 from models.messages import (
     ERROR_GENERIC,
     HEARTBEAT,
 )
 
+from main_loop import cluster
+from main_loop.admission import AdmissionController, Overloaded
 from main_loop.base import GameRunner
 
 root_logger = logging.getLogger("root")
 
-# Set this variable to "threading", "eventlet" or "gevent" to test the
-# different async modes, or leave it set to None for the application to choose
-# the best option based on installed packages.
-async_mode = None
+# ASYNC_MODE can also be "eventlet" or "gevent" to test the different async
+# modes. Unset, the application chooses the best option based on installed
+# packages.
+async_mode = ASYNC_MODE
 
 app = Flask(__name__)
 app.config["SECRET_KEY"] = os.getenv("FLASK_SECRET")
@@ -51,6 +60,8 @@ socketio = SocketIO(
     cors_allowed_origins="*",
     logger=root_logger,
     log_output=True,
+    # Under asyncio the message queue is the AsyncServer's (see asgi.py)
+    **(cluster.socketio_options() if ASYNC_MODE != "threading" else {}),
 )
 thread = None
 thread_lock = Lock()
@@ -82,6 +93,10 @@ root_logger.addHandler(SocketHandler())
 root_logger.addHandler(logging.StreamHandler(sys.stdout))
 
 
+# Other players are only shown the card being played and who has it
+SHOW_CARD_FIELDS = ("id_", "status", "card", "player", "from_")
+
+
 class UniqueQueue(Queue):
     def __init__(self, *args, **kwargs):
         self._set = set()
@@ -100,21 +115,44 @@ class UniqueQueue(Queue):
 
 class WebsocketGameRunner(GameRunner):
     background_tasks = {}
-    max_games = 3
+    # Guards background_tasks. Taken after a game's lock, never before
+    runners_lock = RLock()
+    admission = AdmissionController()
+    # Sids of the sockets connected to this worker right now
+    connected_sids = set()
 
     def __init__(self, *args, name: str = None, **kwargs):
         self.thread = None
+        self.meter = None
         super().__init__(*args, **kwargs)
 
+    def connected(self) -> bool:
+        # A player's client_id outlives its socket (eg. across a restart of
+        # the worker), so only sockets that are connected count
+        return any(
+            player.client_id in self.connected_sids
+            for player in self.state.players.values()
+        )
+
+    def measure(self):
+        if self.meter is None:
+            return nullcontext()
+        return self.meter.measure()
+
     @classmethod
-    def send_to_game(cls, game: Game, data=None, event="text_response"):
-        json.dumps(data)  # If data isn't json dumpable, raise the error here
+    def send_to_game(
+        cls, game: Game, data=None, event="text_response", skip_sid: str = None
+    ):
+        """Sends to everyone in the game's room, except `skip_sid`"""
+        if DEBUG:
+            json.dumps(data)  # If data isn't json dumpable, raise the error here
         # logging.info(f"Emmitting to game {game.name} - event {event}")
-        socketio.emit(event, {"data": data}, to=game.name)
+        socketio.emit(event, {"data": data}, to=game.name, skip_sid=skip_sid)
 
     @classmethod
     def send_to_player(cls, player: Player, data=None, event="text_response"):
-        json.dumps(data)  # If data isn't json dumpable, raise the error here
+        if DEBUG:
+            json.dumps(data)  # If data isn't json dumpable, raise the error here
 
         if player.client_id:
             # logging.info(
@@ -127,7 +165,7 @@ class WebsocketGameRunner(GameRunner):
         self.send_to_player(
             player,
             {
-                "card_instance": model_to_dict(card_instance),
+                "card_instance": card_instance.payload(),
                 "recipients": [rec.name for rec in card_instance.allowed_recipients()],
                 "allowed_actions": player.allowed_actions(card_instance),
                 "valid_topics_for_cancel": [
@@ -136,10 +174,15 @@ class WebsocketGameRunner(GameRunner):
             },
             event="play_card",
         )
-        
-        others = [all_player for all_player in player.game.player_set if all_player!=player] 
-        for player in others:
-            self.send_to_player(player, {"card_instance":model_to_dict(card_instance)}, event="show_card")
+
+        # Everybody else in the game is shown the card. The payload is built
+        # once and emitted to the game's room
+        self.send_to_game(
+            self.game,
+            {"card_instance": card_instance.payload(fields=SHOW_CARD_FIELDS)},
+            event="show_card",
+            skip_sid=player.client_id,
+        )
         # self.send_to_game(self.game, {"player_name": player.name}, event="whos_turn")
 
     def invoke_vote(self, player: Player, pending_vote: CancelVote):
@@ -151,6 +194,7 @@ class WebsocketGameRunner(GameRunner):
 
     def do_round(self, drawing_player: Player, full_round: FullRound):
         """Sleeps socket things"""
+        db.release()
         socketio.sleep(1)
         self.send_to_game(
             self.game,
@@ -169,24 +213,45 @@ class WebsocketGameRunner(GameRunner):
         )
 
     def loop_async(self):
-        """Runs the loop function in a thread"""
-        self.thread = socketio.start_background_task(target=self.loop)
-        self.background_tasks[self.name] = self
+        """Runs the loop function in a thread. The game must have been
+        admitted"""
+        self.meter = self.admission.start(self.name, reserved=True)
+        with self.runners_lock:
+            self.thread = socketio.start_background_task(
+                target=db.connection_scope(self.loop)
+            )
+            self.background_tasks[self.name] = self
+
+    def forget(self):
+        with self.runners_lock:
+            self.background_tasks.pop(self.name, None)
+        self.admission.stop(self.name)
+        super().forget()
 
     def exit(self):
-        self.game.end()
-        self.send_to_game(self.game, None, "endgame")
-        if self.name in self.background_tasks:
-            self.background_tasks.pop(self.name)
-        try:
-            close_room(self.name)
-        except RuntimeError as exc:
-            logging.error("Failed to close room: %s", str(exc))
-            pass
+        with self.lock:
+            self.game.end()
+            GameState.unload(self.game)
+            power_log.flush()
+            self.send_to_game(self.game, None, "endgame")
+            with self.runners_lock:
+                self.background_tasks.pop(self.name, None)
+            self.admission.stop(self.name)
+            try:
+                close_room(self.name)
+            except RuntimeError as exc:
+                logging.error("Failed to close room: %s", str(exc))
+                pass
 
     def perform_action(self, player_name, action, **kwargs):
-        player = self.game.player_set.where(Player.name == player_name).get()
-        result = player.perform_action(action, **kwargs)
+        player = self.state.get_player_by_name(player_name)
+        if not player:
+            raise Player.DoesNotExist(f"Player not found {player_name}")
+        try:
+            result = player.perform_action(action, **kwargs)
+        finally:
+            self.state.flush()
+            self.notify()
         self.send_to_game(
             self.game,
             {
@@ -196,39 +261,60 @@ class WebsocketGameRunner(GameRunner):
             },
             "action_performed",
         )
-        self.send_to_game(self.game, self.game.about(), "about_game")
+        self.game.heartbeat()
         return result
 
     def get_queued_card(self, player_name):
-        player = self.game.player_set.where(Player.name == player_name).get()
+        player = self.state.get_player_by_name(player_name)
+        if not player:
+            raise Player.DoesNotExist(f"Player not found {player_name}")
         if card_instance := player.get_queued_card_instance():
             return card_instance.card
 
     @classmethod
-    def get_by_game(cls, game: Game):
-        """Returns a game runner obj given a Game obj"""
-        # Failsafe - in case this is called for an in-memory game
-        if cls.background_tasks.get(game.name):
-            return cls.get_by_name(game.name)
-
-        runner = cls(game=game, socketio=socketio)
-        runner.loop_async()
-        return runner
+    def get_by_game(cls, game: Game, reserved: bool = False):
+        """Returns a game runner obj given a Game obj. A game which isn't
+        running yet waits for admission, unless `reserved` (see
+        AdmissionController.admit)"""
+        with cls.lock_for(game.name):
+            # Failsafe - in case this is called for an in-memory game
+            if cls.background_tasks.get(game.name):
+                if reserved:
+                    cls.admission.cancel()
+                return cls.get_by_name(game.name)
+
+            if not reserved:
+                cls.admission.admit()
+            try:
+                runner = cls(game=game, socketio=socketio)
+            except Exception:
+                cls.admission.cancel()
+                raise
+            runner.loop_async()
+            return runner
 
     @classmethod
     def get_by_name(cls, name: str):
-        """Returns a game runner obj given a Game name"""
-        if runner := cls.background_tasks.get(name):
-            if runner.thread.is_alive():
+        """Returns a game runner obj given a Game name. Games run by another
+        worker are never loaded here"""
+        if not cluster.owns(name):
+            return None
+        # Nobody else loads or stops the game meanwhile
+        with cls.lock_for(name):
+            with cls.runners_lock:
+                runner = cls.background_tasks.get(name)
+                if runner and not runner.thread.is_alive():
+                    cls.background_tasks.pop(name)
+                    cls.admission.stop(name)
+                    runner = None
+            if runner:
+                runner.touch()
                 return runner
-            else:
-                cls.background_tasks.pop(name)
-                del runner
 
-        # Now load the game from the database, or create a new game
-        game = Game.select().where(Game.name == name)
-        if game.count() == 1:
-            return cls.get_by_game(game.first())
+            # Now load the game from the database, or create a new game
+            game = Game.select().where(Game.name == name)
+            if game.count() == 1:
+                return cls.get_by_game(game.first())
 
     @classmethod
     def get(cls, name: str):
@@ -240,15 +326,22 @@ class WebsocketGameRunner(GameRunner):
 
     @classmethod
     def create(cls, **game_kwargs):
-        """creates a game runner object"""
-        for progress in Game.new(**game_kwargs):
-            if progress["type"] == "message":
-                yield progress
-            if progress["type"] == "result":
-                yield {
-                    "type": "result",
-                    "payload": cls.get_by_game(progress["payload"]),
-                }
+        """creates a game runner object. The game gets a name this worker
+        owns. Nothing is created until the game is admitted"""
+        cls.admission.admit()
+        try:
+            for progress in Game.new(accept_name=cluster.owns, **game_kwargs):
+                if progress["type"] == "message":
+                    yield progress
+                if progress["type"] == "result":
+                    game = progress["payload"]
+        except BaseException:
+            cls.admission.cancel()
+            raise
+        yield {
+            "type": "result",
+            "payload": cls.get_by_game(game, reserved=True),
+        }
 
 
 def password_auth(func):
@@ -267,6 +360,49 @@ def password_auth(func):
         }
 
 
+def owned_game(func):
+    """Answers requests for a game run by another worker with the address
+    of that worker, which the client should reconnect to"""
+
+    @wraps(func)
+    def owned(message):
+        game_name = message.get("game")
+        if game_name and not cluster.owns(game_name):
+            return {
+                "status": 307,
+                "error": f"Game {game_name} is run by another worker",
+                "worker": cluster.owner(game_name),
+            }
+        return func(message)
+
+    return owned
+
+
+def locked_game(func):
+    """Handles requests about a game one at a time, and never while its
+    main loop works on it (see GameRunner.lock_for)"""
+
+    @wraps(func)
+    def locked(message):
+        game_name = message.get("game")
+        with WebsocketGameRunner.lock_for(game_name) if game_name else nullcontext():
+            return func(message)
+
+    return locked
+
+
+def metered_game(func):
+    """Counts the request towards the cost of its game, if it is running"""
+
+    @wraps(func)
+    def metered(message):
+        meter = WebsocketGameRunner.admission.meters.get(message.get("game"))
+        with meter.measure() if meter else nullcontext():
+            return func(message)
+
+    return metered
+
+
 @app.route("/")
 def index():
     """Renders the main page of the game"""
@@ -275,11 +411,33 @@ def index():
 
 @app.route("/health")
 def health_check():
-    """Returns an OK"""
-    return "OK\n"
+    """Returns an OK and how many more games this worker can take"""
+    return {"status": "OK", "capacity": WebsocketGameRunner.admission.status()}
+
+
+@app.route("/health/db")
+def db_health_check():
+    """Returns the state of the database connection pool"""
+    return db.status()
+
+
+@app.route("/health/cluster")
+def cluster_health_check():
+    """Returns this worker's address and all workers"""
+    with WebsocketGameRunner.runners_lock:
+        games = sorted(WebsocketGameRunner.background_tasks)
+    return {
+        "worker": cluster.WORKER_ID,
+        "workers": cluster.WORKERS,
+        "games": games,
+    }
 
 
 @socketio.event
+@owned_game
+@locked_game
+@metered_game
+@db.connection_scope
 def about_game(message):
     """Returns info about a game"""
     logging.info(
@@ -290,14 +448,20 @@ def about_game(message):
     game_name = message["game"]
     runner = WebsocketGameRunner.get_by_name(game_name)
     if runner:
+        # Also how clients resync after missing an about_game_delta
         return {
             "status": 200,
             "about": runner.game.about(),
+            "version": runner.state.about_version,
         }
     else:
         return {"status": 404, "error": f"Game not found {game_name}"}
     
 @socketio.event
+@owned_game
+@locked_game
+@metered_game
+@db.connection_scope
 def metadata_cancel(message):
     """Returns info about a game"""
     logging.info(
@@ -324,6 +488,10 @@ def metadata_cancel(message):
 
 
 @socketio.event
+@owned_game
+@locked_game
+@metered_game
+@db.connection_scope
 def join_game(message):
     """Takes a player name and game name. Joins the game. The game needs
     to be created with another API"""
@@ -348,16 +516,20 @@ def join_game(message):
             return {"status": 200, "message": f"Already joined game {game_name}"}
         player.client_id = request.sid
         player.save()
+        runner.state.update_player(player)
+        runner.notify()
         join_room(game_name)
         return {
             "status": 200,
             "about": runner.game.about(),
+            "version": runner.state.about_version,
         }
     else:
         return {"status": 404, "error": f"Game not found {game_name}"}
 
 
 @socketio.event
+@db.connection_scope
 def player_hand(message):
     logging.info(
         f"Incoming event - {inspect.getframeinfo(inspect.currentframe()).function} |"
@@ -373,10 +545,14 @@ def player_hand(message):
 
     cursor = db.execute_sql(
         """
-        SELECT card.id_ as cid, cardinstance.id_ as ciid, card.description, card.image
+        SELECT card.id_ as cid, cardinstance.id_ as ciid,
+            COALESCE(card.description, catalogcard.description),
+            COALESCE(card.image, catalogcard.image)
         FROM card
         INNER JOIN cardinstance 
         ON cardinstance.card_id=card.id_
+        LEFT JOIN catalogcard
+        ON catalogcard.id_=card.catalog_card_id
         WHERE cardinstance.id_ in (
             SELECT card_instance_id
             FROM playerhand
@@ -406,6 +582,7 @@ def player_hand(message):
 
 
 @socketio.event
+@db.connection_scope
 def create_game(message):
     """Creates a game"""
     logging.info(
@@ -435,7 +612,7 @@ def create_game(message):
         ):
             if progress["type"] == "message":
                 emit("create_room:progress", progress)
-                eventlet.sleep(0)
+                socketio.sleep(0)
             if progress["type"] == "result":
                 runner = progress["payload"]
                 join_room(runner.name)
@@ -452,6 +629,10 @@ def create_game(message):
 
 
 @socketio.event
+@owned_game
+@locked_game
+@metered_game
+@db.connection_scope
 def load_game(message):
     """Loads a game"""
     logging.info(
@@ -474,6 +655,10 @@ def load_game(message):
 
 
 @socketio.event
+@owned_game
+@locked_game
+@metered_game
+@db.connection_scope
 def get_queued_card(message):
     """Get the state given a player"""
     logging.info(
@@ -499,6 +684,10 @@ def get_queued_card(message):
 
 
 @socketio.event
+@owned_game
+@locked_game
+@metered_game
+@db.connection_scope
 def player_action(message):
     logging.info(
         f"Incoming event - {inspect.getframeinfo(inspect.currentframe()).function} |"
@@ -566,6 +755,7 @@ def connect(message=None):
         f"Incoming event - {inspect.getframeinfo(inspect.currentframe()).function} |"
         f" {message}"
     )
+    WebsocketGameRunner.connected_sids.add(request.sid)
     return {
         "status": 200,
         "message": "Connected",
@@ -573,23 +763,33 @@ def connect(message=None):
 
 
 @socketio.on("disconnect")
-def test_disconnect():
+@db.connection_scope
+def test_disconnect(reason=None):
     print("Client disconnected", request.sid)
+    WebsocketGameRunner.connected_sids.discard(request.sid)
     # set player.client_id to NULL for this sid
     player = Player.select().where(Player.client_id == request.sid).first()
     if player is not None:
-        player.client_id = None
-        player.save()
+        state = GameState.get(player.game_id, load=False)
+        # The main loop and requests about the game may be using its state
+        with WebsocketGameRunner.lock_for(state.game.name) if state else nullcontext():
+            player.client_id = None
+            player.save()
+            if state:
+                state.update_player(player)
 
 
 @socketio.on_error()
 def error_handler(exc):
+    if isinstance(exc, Overloaded):
+        logging.warning(str(exc))
+        return {"status": 503, "error": str(exc), "capacity": exc.status}
     # Let our custom logger handle things
     logging.exception(exc)
 
 
 def run():
-    socketio.run(app, host="0.0.0.0", port=5000)
+    socketio.run(app, host="0.0.0.0", port=int(os.getenv("PORT", "5000")))
 
 
 if __name__ == "__main__":
@@ -3,14 +3,19 @@ from .base import Game, Round, FullRound, db
 from .card import Card, CardInstance
 from .player import Player, PlayerInitialBias, PlayerInitialAffinity, Score
 from .counters import AffinityTopic, Color
-from .powers import PlayerPower, CancelStatus, CancelVote
+from .powers import PlayerPower, CancelStatus, CancelVote, power_log
 from .card_queue import PlayerCardQueue
-from .encyclopedia import Article
+from .encyclopedia import Article, CatalogArticle
 from .playerhand import PlayerHand
+from .catalog import Catalog, CatalogCard
+from .state import GameState
 
 ALL_MODELS = [
     # This is the order in which the tables will be created
     Game,
+    Catalog,
+    CatalogCard,
+    CatalogArticle,
     Round,
     FullRound,
     AffinityTopic,
@@ -0,0 +1,68 @@
+"""Append-only logs written in the background
+
+Some tables are only kept as a history (eg. every change of a player's
+powers) and are never read while a game is running. Rows for them are
+queued and inserted in batches by a background thread, so the game loop
+doesn't wait on them. Whatever is still queued is written when a game
+stops and when the process exits.
+"""
+import atexit
+import datetime
+import logging
+import threading
+from queue import Empty, Queue
+
+from constants import IMPORT_BATCH_SIZE
+from .base import db
+
+
+class AuditLog:
+    """Queues rows for `model` and inserts them from a background thread"""
+
+    def __init__(self, model, batch_size: int = IMPORT_BATCH_SIZE):
+        self.model = model
+        self.batch_size = batch_size
+        self.queue = Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+        # The writer thread is a daemon, so nothing queued is lost on exit
+        atexit.register(self.flush)
+
+    def append(self, **row):
+        """Queues a row. created_at is the time it was appended, not the
+        time it was written"""
+        row.setdefault("created_at", datetime.datetime.now())
+        self.queue.put(row)
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+
+    def _take(self, block: bool):
+        """Takes up to a batch of rows off the queue"""
+        rows = []
+        try:
+            rows.append(self.queue.get(block=block))
+            while len(rows) < self.batch_size:
+                rows.append(self.queue.get_nowait())
+        except Empty:
+            pass
+        return rows
+
+    def _write(self, rows):
+        try:
+            with db.atomic():
+                self.model.insert_many(rows).execute()
+        except Exception:
+            logging.exception("Failed to write %d %s rows", len(rows), self.model.__name__)
+
+    @db.connection_scope
+    def _run(self):
+        while rows := self._take(block=True):
+            self._write(rows)
+            db.release()
+
+    def flush(self):
+        """Writes everything queued so far from the calling thread"""
+        while rows := self._take(block=False):
+            self._write(rows)
@@ -4,15 +4,24 @@ import os
 import random
 from io import StringIO
 import json
+import time
 import uuid
 import peewee
 from playhouse.dataset import DataSet
 from .utils import model_to_dict
+from .pool import MeteredPooledMySQLDatabase
 import peeweedbevolve
 
 # import profiling_utils
 
-from constants import PLAYER_WIN_SCORE, TGB_END_SCORE, NUM_AFFINITY_TOPICS
+from constants import (
+    PLAYER_WIN_SCORE,
+    TGB_END_SCORE,
+    NUM_AFFINITY_TOPICS,
+    IMPORT_BATCH_SIZE,
+    ABOUT_FULL_SNAPSHOT_INTERVAL,
+    GAME_NAME_TRIES,
+)
 
 # TODO shift these to environment variables
 
@@ -24,14 +33,23 @@ DB_PORT = os.getenv("DB_PORT")
 
 print(DB_NAME, DB_HOST, DB_USERNAME, DB_PASSWORD, DB_PORT)
 
-db = peewee.MySQLDatabase(
+# Connection pool - see models/pool.py
+DB_MAX_CONNECTIONS = int(os.getenv("DB_MAX_CONNECTIONS", "20"))
+# Connections older than this many seconds are closed instead of reused
+DB_STALE_TIMEOUT = int(os.getenv("DB_STALE_TIMEOUT", "300"))
+# Seconds to wait for a free connection before giving up
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "10"))
+
+db = MeteredPooledMySQLDatabase(
     DB_NAME,
     host=DB_HOST,
     port=int(DB_PORT),
     user=DB_USERNAME,
     password=DB_PASSWORD,
+    max_connections=DB_MAX_CONNECTIONS,
+    stale_timeout=DB_STALE_TIMEOUT,
+    timeout=DB_POOL_TIMEOUT,
 )
-dataset = DataSet(db)
 
 
 def model_id_generator():
@@ -66,7 +84,6 @@ class Model(peewee.Model):
                 .
             ]
         """
-        # TODO optimise this
         objects = []
         if not json_dict:
             with open(json_path) as infile:
@@ -74,36 +91,68 @@ class Model(peewee.Model):
         for dict_ in json_dict:
             if defaults:
                 dict_.update(defaults)
-            obj = cls.create(**dict_)
-            objects.append((dict_, obj))
+            objects.append((dict_, cls(**dict_)))
+        cls.bulk_insert([obj for _, obj in objects])
         return objects
 
+    @classmethod
+    def bulk_insert(cls, objs, batch_size=IMPORT_BATCH_SIZE):
+        """Inserts unsaved objects with multi-row INSERTs, in one transaction.
+
+        IDs are generated when an object is instantiated, so objects can
+        already refer to each other (eg. a fake card to its original) - as
+        long as the referred object comes first."""
+        rows = [obj.__data__ for obj in objs]
+        # Every row of an INSERT needs the same columns. Columns that only
+        # some objects set are left NULL in the others, as create() would
+        columns = set().union(*rows)
+        with db.atomic():
+            for batch in peewee.chunked(rows, batch_size):
+                cls.insert_many(
+                    [{column: row.get(column) for column in columns} for row in batch]
+                ).execute()
+        for obj in objs:
+            obj._dirty.clear()
+
     @classmethod
     def export_to_file(cls, format, output_path):
+        # Reads the schema, so only connected to when exporting
+        dataset = DataSet(db)
         ds_table = dataset[cls._meta.name]
         dataset.freeze(ds_table.all(), format=format, filename=output_path)
 
     def next(self, order_by=None):
         """Returns the next obj. You can specify the order_by as a field.
         if order_by == None, it will order by created_at"""
-
-        if not order_by:
-            order_by = FullRound.created_at
-
-        objs = self.select().order_by(order_by).iterator()
-        while obj := next(objs, None):
-            if obj.id_ == self.id_:
-                return next(objs, None)
+        return self._adjacent(order_by, forward=True)
 
     def previous(self, order_by=None):
         """Returns the prev obj. You can specify the order_by as a field.
         if order_by == None, it will order by created_at"""
+        return self._adjacent(order_by, forward=False)
+
+    def adjacent_query(self):
+        """The objects next/previous look through"""
+        return self.select()
 
+    def _adjacent(self, order_by, forward: bool):
+        """Seeks to the obj right after (or before) this one in the
+        (order_by, id_) order, instead of walking the table up to this one"""
+        cls = type(self)
         if not order_by:
-            order_by = FullRound.created_at
-        order_by = order_by.desc()
+            order_by = cls.created_at
+        value = getattr(self, order_by.name)
+        if value is None:
+            # Filled in by the database (eg. created_at) - not read back yet
+            value = cls.select(order_by).where(cls.id_ == self.id_).scalar()
 
-        return self.next(order_by=order_by)
+        if forward:
+            after = (order_by > value) | ((order_by == value) & (cls.id_ > self.id_))
+            ordering = (order_by.asc(), cls.id_.asc())
+        else:
+            after = (order_by < value) | ((order_by == value) & (cls.id_ < self.id_))
+            ordering = (order_by.desc(), cls.id_.desc())
+        return self.adjacent_query().where(after).order_by(*ordering).first()
 
 
 class Game(Model):
@@ -113,11 +162,27 @@ class Game(Model):
     draw_fn_name = peewee.CharField(unique=False)
     password = peewee.CharField(unique=False)
     ended = peewee.BooleanField(unique=False, default=False)
+    # Total global bias - the sum of all bias scores of all players. Kept up
+    # to date by Score.inc_bias, see `check_total_global_bias` to verify it
+    tgb = peewee.IntegerField(default=0)
+
+    @property
+    def state(self):
+        """In-memory state of this game"""
+        from .state import GameState
+
+        return GameState.get(self)
+
+    def state_if_loaded(self):
+        """In-memory state of this game, or None if it hasn't been loaded"""
+        from .state import GameState
+
+        return GameState.get(self, load=False)
 
     def active(self):
         # TODO implement this
         # TODO add timeout
-        for player in self.player_set:
+        for player in self.state.players.values():
             if player.clout() >= PLAYER_WIN_SCORE:
                 return False
 
@@ -131,11 +196,44 @@ class Game(Model):
 
     def started(self):
         """Checks if all players have joined"""
-        return not self.get_unclaimed_player()
+        return all(player.name for player in self.state.players.values())
 
     def heartbeat(self):
-        """Sends an about event to the game room"""
-        self.runner.send_to_game(game=self, data=self.about(), event="about_game")
+        """Sends what changed about the game to the game room"""
+        if update := self.about_update():
+            event, data = update
+            self.runner.send_to_game(game=self, data=data, event=event)
+
+    def about_update(self):
+        """Returns the (event, data) to broadcast about this game, or None if
+        nothing changed since the last broadcast.
+
+        Every broadcast bumps the game's about version, which only ever
+        grows - also across reloads of the game. Usually it is an
+        "about_game_delta" with only what changed since the previous version:
+            {"version": 8, "changes": {"total_global_bias": 3,
+                                       "players": {<player id>: {"score": 2}}}}
+        The first one, and one every ABOUT_FULL_SNAPSHOT_INTERVAL seconds, is
+        the full about() document (plus its version) as "about_game". Clients
+        which miss a version can resync with the about_game request (or
+        join_game), whose reply carries the current version."""
+        state = self.state
+        about = self.about()
+        # Only what the document says beyond the game itself is compared -
+        # every nested object carries a copy of the game (eg. its tgb)
+        current = about_diffable(about)
+        previous, state.about_snapshot = state.about_snapshot, current
+        if previous is not None:
+            changes = about_changes(previous, current)
+            if not changes:
+                return None
+        state.about_version += 1
+
+        now = time.monotonic()
+        if previous is None or now - state.about_sent_at >= ABOUT_FULL_SNAPSHOT_INTERVAL:
+            state.about_sent_at = now
+            return "about_game", dict(about, version=state.about_version)
+        return "about_game_delta", {"version": state.about_version, "changes": changes}
 
     @property
     def current_round(self):
@@ -144,9 +242,7 @@ class Game(Model):
             round_ = Round.create(
                 game=self,
                 started=False,
-                full_round=FullRound.select()
-                .order_by(FullRound.created_at.desc())
-                .first(),
+                full_round=FullRound.latest(self),
             )
         return round_
 
@@ -166,19 +262,35 @@ class Game(Model):
 
     def total_global_bias(self):
         """Total global bias of the game"""
-        # Sum of all bias points
-        from models import Player
+        return self.state.tgb
+
+    def check_total_global_bias(self, rebuild: bool = False):
+        """Recomputes the total global bias from the score table and compares
+        it with the stored counter. If `rebuild`, the counter is overwritten
+        with the recomputed value.
 
-        tgb = 0
-        for player in self.player_set:
-            for bias in player.all_biases().values():
-                tgb += bias
+        Returns a tuple of (stored, recomputed)"""
+        from .player import Score, ScoreType
 
-        return tgb
+        recomputed = (
+            Score.select(peewee.fn.COALESCE(peewee.fn.SUM(Score.value), 0))
+            .where(Score.game == self)
+            .where(Score.type == ScoreType.BIAS.value)
+            .scalar()
+        )
+        stored = Game.select(Game.tgb).where(Game.id_ == self.id_).scalar()
+        if rebuild and stored != recomputed:
+            Game.update(tgb=recomputed).where(Game.id_ == self.id_).execute()
+            self.tgb = recomputed
+            if state := self.state_if_loaded():
+                state.tgb = recomputed
+                state.game.tgb = recomputed
+        return stored, recomputed
 
     @classmethod
-    def new_name(cls):
-        """Returns a new name for a new game"""
+    def new_name(cls, accept=None):
+        """Returns a new name for a new game. If given, `accept(name)` has to
+        be true for the name (eg. to pick a name this worker owns)"""
         verbs = ["ambitious", "basic", "careful", "dark", "eager","fab","glib","happy","inept","jolly","keen","lavish","magic","neat","official","perfect","quack","rare","sassy","tall","velvet","weak"]
         nouns = [
             "apple",
@@ -205,11 +317,17 @@ class Game(Model):
             "water",
             "zebra"
         ]
-        number = "%04d" % random.randint(0, 9999)
-        name = f"{random.choice(verbs)}-{random.choice(nouns)}-{number}"
-        if cls.select().where(cls.name == name).exists():
-            return cls.new_name()
-        return name
+        for _ in range(GAME_NAME_TRIES):
+            number = "%04d" % random.randint(0, 9999)
+            name = f"{random.choice(verbs)}-{random.choice(nouns)}-{number}"
+            if accept is not None and not accept(name):
+                continue
+            if cls.select().where(cls.name == name).exists():
+                continue
+            return name
+        raise ValueError(
+            f"No acceptable game name found in {GAME_NAME_TRIES} tries"
+        )
 
     @classmethod
     # @profiling_utils.profile
@@ -220,18 +338,19 @@ class Game(Model):
         topics_filepath: str,
         cards_filepath: str,
         encyclopedia_filepath: str,
+        accept_name=None,
         **model_kwargs,
     ):
-        """Creates a new game and performs initial setup"""
+        """Creates a new game and performs initial setup. `accept_name` is
+        passed on to `new_name`"""
         from .player import Player
         from .counters import Color, AffinityTopic
-        from .card import Card
-        from .encyclopedia import Article
+        from .catalog import Catalog
         from time import sleep
 
         encyclopedia_filepath = "config_jsons/example1/articles.json"
 
-        name = cls.new_name()
+        name = cls.new_name(accept_name)
 
         # TODO create initial biases
         game = cls.create(name=name, **model_kwargs)
@@ -260,14 +379,12 @@ class Game(Model):
             player = Player.create(color=color, game=game, sequence=sequences[idx])
         yield {"type": "message", "payload": "Players, Bias, Affinities Initialized"}
 
-        Card.import_from_json(
-            json_path=cards_filepath, defaults={"game_id": str(game.id_)}
-        )
+        # The card and encyclopedia files are imported once into a shared
+        # catalog. The game only gets a slim overlay of the catalog's cards
+        # and reads the encyclopedia from the catalog
+        catalog = Catalog.get_or_build(cards_filepath, encyclopedia_filepath)
+        catalog.copy_cards_to(game)
         yield {"type": "message", "payload": "Cards Initialized"}
-
-        Article.import_from_json(
-            json_path=encyclopedia_filepath, defaults={"game_id": str(game.id_)}
-        )
         yield {"type": "message", "payload": "Encyclopedia Initialized"}
         yield {"type": "message", "payload": "Joining Game"}
 
@@ -304,15 +421,11 @@ class Game(Model):
         )
 
     def draw(self, player, full_round):
-        from .player import Player
         from deck_generators import GENERATORS
 
         self.add_round(full_round=full_round)
         draw_fn = GENERATORS.get(self.draw_fn_name)
-        Player.update(current=False).where(Player.game == self).execute()
-        Player.update(sequence=Player.sequence + 100, current=True).where(
-            Player.id_ == player.id_
-        ).execute()
+        self.state.set_current(player.id_)
         return draw_fn(player)
 
     @classmethod
@@ -323,14 +436,30 @@ class Game(Model):
         return cls.select().where(cls.name == name)
 
     def about(self):
-        """Returns a dictionary about this game"""
-        from .player import Player
+        """Returns a dictionary about this game
+
+        The snapshot is assembled from the game state - players, scores,
+        colors and topics are already in memory - so building it costs no
+        queries however many players the game has. Foreign keys are filled
+        in from the loaded objects instead of being fetched one by one.
+        """
+        state = self.state
+        game_dict = model_to_dict(self, recurse=False)
+
+        def to_dict(obj, **related):
+            dict_ = model_to_dict(obj, recurse=False)
+            dict_["game"] = game_dict
+            dict_.update(related)
+            return dict_
 
-        current_player = self.player_set.where(Player.current == True).first()
+        colors = {color.id_: to_dict(color) for color in state.colors}
 
+        current_player = None
         players = []
-        for player in self.player_set:
-            dict_ = model_to_dict(player)
+        for player in state.players.values():
+            dict_ = to_dict(player, color=colors.get(player.color_id))
+            if player.current:
+                current_player = dict(dict_)
             dict_["affinities"] = player.all_affinities()
             dict_["biases"] = player.all_biases()
             dict_["score"] = player.clout()
@@ -339,37 +468,130 @@ class Game(Model):
         return {
             "name": self.name,
             "players": players,
-            "colors": [model_to_dict(color) for color in self.color_set],
-            "topics": [model_to_dict(topics) for topics in self.affinitytopic_set],
+            "colors": list(colors.values()),
+            "topics": [to_dict(topic) for topic in state.topics],
             "draw_fn_name": self.draw_fn_name,
-            "current_drawing_player": model_to_dict(current_player)
-            if current_player
-            else None,
+            "current_drawing_player": current_player,
             "total_global_bias": self.total_global_bias(),
             "started": self.started(),
             "active": self.active(),
         }
 
     def update_powers(self):
-        """Updates powers of each of the players in this game"""
-        for player in self.player_set:
+        """Updates powers of each of the players in this game. Powers only
+        depend on scores, so nothing is done unless a score changed"""
+        state = self.state
+        if state.powers_version == state.scores_version:
+            return
+        for player in state.players.values():
             player.update_powers()
+        state.powers_version = state.scores_version
 
     def end(self):
         self.ended = True
         self.save()
 
 
+def about_diffable(about: dict) -> dict:
+    """Game.about() without the copy of the game nested in its players,
+    colors and topics. The game's own fields are at the top level already, so
+    a change to the game (eg. its tgb) would otherwise show up in every
+    nested object"""
+
+    def strip(obj):
+        if obj is None:
+            return None
+        dict_ = {key: value for key, value in obj.items() if key != "game"}
+        if isinstance(dict_.get("color"), dict):
+            dict_["color"] = strip(dict_["color"])
+        return dict_
+
+    return dict(
+        about,
+        players=[strip(player) for player in about["players"]],
+        colors=[strip(color) for color in about["colors"]],
+        topics=[strip(topic) for topic in about["topics"]],
+        current_drawing_player=strip(about["current_drawing_player"]),
+    )
+
+
+def about_changes(old: dict, new: dict) -> dict:
+    """The fields of Game.about() which changed. Players are keyed by id, with
+    only their changed fields"""
+    changes = {
+        key: value
+        for key, value in new.items()
+        if key != "players" and old.get(key) != value
+    }
+    old_players = {player["id_"]: player for player in old.get("players", [])}
+    players = {}
+    for player in new["players"]:
+        old_player = old_players.get(player["id_"], {})
+        changed = {
+            key: value for key, value in player.items() if old_player.get(key) != value
+        }
+        if changed:
+            players[player["id_"]] = changed
+    if players:
+        changes["players"] = players
+    return changes
+
+
 class InGameModel(Model):
     """A Model linked to a game"""
 
     game = peewee.ForeignKeyField(Game)
 
+    def adjacent_query(self):
+        return self.select().where(type(self).game == self.game_id)
+
+    @property
+    def state(self):
+        """In-memory state of the game this object belongs to"""
+        from .state import GameState
+
+        return GameState.get(self.game_id)
+
 
 class FullRound(InGameModel):
     """A set of rounds"""
 
-    pass
+    # 1, 2, 3... within a game. Rounds from before this was added have none
+    sequence = peewee.IntegerField(null=True)
+
+    class Meta:
+        indexes = ((("game", "sequence"), True),)
+
+    @classmethod
+    def latest(cls, game):
+        """Returns the last full round of `game`, or None"""
+        return (
+            cls.select()
+            .where(cls.game == game)
+            .order_by(cls.sequence.desc(), cls.created_at.desc())
+            .first()
+        )
+
+    def save(self, *args, **kwargs):
+        # Numbered on insert. MAX() is a lookup on the (game, sequence) index
+        if kwargs.get("force_insert") and self.sequence is None:
+            last = (
+                FullRound.select(peewee.fn.MAX(FullRound.sequence))
+                .where(FullRound.game == self.game_id)
+                .scalar()
+            )
+            self.sequence = (last or 0) + 1
+        return super().save(*args, **kwargs)
+
+    def next(self, order_by=None):
+        if order_by or self.sequence is None:
+            return super().next(order_by)
+        return self.adjacent_query().where(FullRound.sequence == self.sequence + 1).first()
+
+    def previous(self, order_by=None):
+        if order_by or self.sequence is None:
+            return super().previous(order_by)
+        return self.adjacent_query().where(FullRound.sequence == self.sequence - 1).first()
 
 
 class Round(InGameModel):
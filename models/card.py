@@ -2,17 +2,27 @@
 import json
 import peewee
 from playhouse.shortcuts import model_to_dict as mtd_original
-from .base import InGameModel
+from .utils import model_to_dict
+from .base import InGameModel, db
 from .player import Player
 from .counters import AffinityTopic, Color
+from .catalog import CatalogCard, copied_id, from_catalog
 from peewee import fn
 
+# Fields a card reads from its catalog card while it has no value of its own
+CATALOG_FIELDS = ("title", "description", "storyline", "image")
+
 
 class Card(InGameModel):
     """Represents a card in the game"""
 
-    title = peewee.CharField()
-    description = peewee.TextField()
+    # Cards of games created from a catalog (see models/catalog.py) only hold
+    # what changes while the game is played. The CATALOG_FIELDS are NULL
+    # unless the game changed them
+    catalog_card = peewee.ForeignKeyField(CatalogCard, null=True)
+
+    title = from_catalog(peewee.CharField(null=True))
+    description = from_catalog(peewee.TextField(null=True))
     affinity_towards = peewee.ForeignKeyField(AffinityTopic, null=True)
     affinity_count = peewee.IntegerField(null=True)  # Can be +1 or -1
 
@@ -58,18 +68,73 @@ class Card(InGameModel):
     #     """cards should be a query selector"""
     #     return cards.where(cls._is_current_int == 0).first()
 
-    storyline = peewee.CharField(default="none")
+    storyline = from_catalog(peewee.CharField(default="none", null=True))
     storyline_index = peewee.IntegerField(default=0)
 
-    image = peewee.FixedCharField(default="", max_length=50)  # image url
+    # image url
+    image = from_catalog(peewee.FixedCharField(default="", max_length=50, null=True))
+
+    def _with_catalog_fields(self, dict_: dict) -> dict:
+        """Fills in the CATALOG_FIELDS of a dict of this card, which
+        model_to_dict reads without falling back to the catalog"""
+        dict_.pop("catalog_card", None)
+        for name in CATALOG_FIELDS:
+            dict_[name] = getattr(self, name)
+        return dict_
 
     def to_dict(self, **kwargs):
         """Calls peewee's model_to_dict and passes kwargs to it"""
-        dict_ = mtd_original(self, **kwargs)
+        kwargs["exclude"] = [*(kwargs.get("exclude") or []), Card.catalog_card]
+        dict_ = self._with_catalog_fields(mtd_original(self, **kwargs))
         fakes = [fake.to_dict() for fake in self.fakes]
         dict_["fakes"] = fakes
         return dict_
 
+    def save(self, *args, **kwargs):
+        result = super().save(*args, **kwargs)
+        from .state import GameState
+
+        if state := GameState.get(self.game_id, load=False):
+            state.forget_card_payload(self.id_)
+            # The original's payload lists this card among its fakes
+            state.forget_card_payload(self.original_id)
+        return result
+
+    def payload(self) -> dict:
+        """JSON-ready dict of this card and its fakes, as sent to clients.
+
+        Unlike to_dict, related objects come from the game state and players
+        are reduced to their id and name. The payload is cached in the game
+        state until the card or one of its fakes is saved"""
+        state = self.state
+        payload = state.card_payloads.get(self.id_)
+        if payload is None:
+            payload = self._payload(state)
+            payload["fakes"] = [fake._payload(state) for fake in self.fakes]
+            state.card_payloads[self.id_] = payload
+        return payload
+
+    def _payload(self, state) -> dict:
+        topics = {topic.id_: topic for topic in state.topics}
+        colors = {color.id_: color for color in state.colors}
+
+        def related(objs, id_):
+            if id_ is None:
+                return None
+            if obj := objs.get(id_):
+                return model_to_dict(obj, recurse=False)
+            return {"id_": id_}
+
+        dict_ = model_to_dict(
+            self._with_catalog_fields(mtd_original(self, recurse=False))
+        )
+        dict_["affinity_towards"] = related(topics, self.affinity_towards_id)
+        dict_["bias_against"] = related(colors, self.bias_against_id)
+        dict_["original_player"] = state.player_summary(self.original_player_id)
+        dict_["faked_by"] = state.player_summary(self.faked_by_id)
+        dict_["fakes"] = []
+        return dict_
+
     def add_bias(self, against: Color):
         """Adds a bias to this card"""
         if self.bias_against:
@@ -113,6 +178,16 @@ class Card(InGameModel):
 
     @classmethod
     def create_from_dict(cls, dict_, defaults=None):
+        """Creates a card and its fakes"""
+        cls.import_from_json(json_dict=[dict_], defaults=defaults)
+
+    @classmethod
+    def from_dict(cls, dict_, topics, colors, defaults=None):
+        """Returns the unsaved card described by `dict_`, followed by its
+        fakes. Returns an empty list if the card is to be skipped.
+
+        `topics` and `colors` map names to IDs. Colors missing from `colors`
+        are created and added to it"""
         defaults = defaults or {}
         fakes = dict_.pop("fakes", [])
         affinity_towards = dict_.pop("affinity_towards", None)
@@ -120,39 +195,125 @@ class Card(InGameModel):
 
         dict_.update(defaults)
         if not dict_.get("description"):
-            return
+            return []
 
-        topic = None
-        if affinity_towards:
-            try:
-                topic = AffinityTopic.get(name=affinity_towards, **defaults)
-            except AffinityTopic.DoesNotExist:
-                # Skip this card
-                return
+        if affinity_towards and affinity_towards not in topics:
+            # Skip this card
+            return []
 
-        created = cls.create(**dict_)
+        card = cls(**dict_)
 
         if affinity_towards:
-            created.affinity_towards_id = topic.id_
+            card.affinity_towards_id = topics[affinity_towards]
 
         if bias_against:
-            color, _ = Color.get_or_create(name=bias_against, **defaults)
-            created.bias_against_id = color.id_
-
-        created.save()
+            if bias_against not in colors:
+                colors[bias_against] = Color.create(name=bias_against, **defaults).id_
+            card.bias_against_id = colors[bias_against]
 
+        cards = [card]
         for fake in fakes:
-            fake["original_id"] = created.id_
-            cls.create_from_dict(fake, defaults)
+            fake["original_id"] = card.id_
+            cards += cls.from_dict(fake, topics, colors, defaults)
+        return cards
+
+    @classmethod
+    def copy_from_catalog(cls, catalog, game):
+        """Adds the cards of a catalog (see models/catalog.py) to `game`.
+        Only what changes per game is stored - the text is read from the
+        catalog.
+
+        Topics and colors are matched by name. Like create_from_dict, cards
+        about a topic the game doesn't play with are skipped - along with
+        their fakes"""
+        fields = [
+            cls.id_,
+            cls.game,
+            cls.catalog_card,
+            cls.affinity_towards,
+            cls.affinity_count,
+            cls.bias_against,
+            cls.fake,
+            cls.original,
+            cls.discarded,
+            cls.tgb,
+            cls.storyline_index,
+        ]
+        query = (
+            CatalogCard.select(
+                copied_id(game, CatalogCard.id_),
+                peewee.Value(game.id_),
+                CatalogCard.id_,
+                AffinityTopic.id_,
+                CatalogCard.affinity_count,
+                Color.id_,
+                CatalogCard.fake,
+                copied_id(game, CatalogCard.original),
+                peewee.Value(False),
+                CatalogCard.tgb,
+                CatalogCard.storyline_index,
+            )
+            .join(
+                AffinityTopic,
+                peewee.JOIN.LEFT_OUTER,
+                on=(
+                    (AffinityTopic.name == CatalogCard.affinity_towards)
+                    & (AffinityTopic.game == game)
+                ),
+            )
+            .switch(CatalogCard)
+            .join(
+                Color,
+                peewee.JOIN.LEFT_OUTER,
+                on=((Color.name == CatalogCard.bias_against) & (Color.game == game)),
+            )
+            .switch(CatalogCard)
+            .where(CatalogCard.catalog == catalog)
+            .where(
+                CatalogCard.affinity_towards.is_null()
+                | AffinityTopic.id_.is_null(False)
+            )
+        )
+
+        # First the originals, then the fakes of the originals that were copied
+        cls.insert_from(query.where(CatalogCard.original.is_null()), fields).execute()
+        fakes = query.join(
+            cls, on=(cls.id_ == copied_id(game, CatalogCard.original))
+        ).where(CatalogCard.original.is_null(False))
+        cls.insert_from(fakes, fields).execute()
+
+    def article(self):
+        """This card's encyclopedia article, or None. Cards from a catalog
+        use the catalog's articles"""
+        from .encyclopedia import CatalogArticle
+
+        if self.catalog_card_id is not None:
+            return (
+                CatalogArticle.select()
+                .where(CatalogArticle.card == self.catalog_card_id)
+                .first()
+            )
+        return self.encyclopedia_article.first()
 
     @classmethod
     def import_from_json(cls, json_dict=None, json_path=None, defaults=None):
-        """First creates the original cards, then the fakes"""
+        """Creates the cards and their fakes. Topics and colors are looked up
+        once and the cards are inserted in batches, in one transaction"""
+        defaults = defaults or {}
         if not json_dict:
             with open(json_path) as infile:
                 json_dict = json.load(infile)
-        for dict_ in json_dict:
-            cls.create_from_dict(dict_, defaults=defaults)
+
+        with db.atomic():
+            topics = {
+                topic.name: topic.id_
+                for topic in AffinityTopic.select().filter(**defaults)
+            }
+            colors = {color.name: color.id_ for color in Color.select().filter(**defaults)}
+            cards = []
+            for dict_ in json_dict:
+                cards += cls.from_dict(dict_, topics, colors, defaults)
+            cls.bulk_insert(cards)
 
 
 class CardInstance(InGameModel):
@@ -195,6 +356,15 @@ class CardInstance(InGameModel):
         # Unique together
         indexes = ((("card", "player", "game", "clone"), True),)
 
+    def save(self, *args, **kwargs):
+        result = super().save(*args, **kwargs)
+        # Keep the loaded game's record of who got this card up to date
+        from .state import GameState
+
+        if state := GameState.get(self.game_id, load=False):
+            state.add_card_holder(self.card_id, self.clone, self.player_id)
+        return result
+
     @property
     def status(self):
         """Status of this card instance - can be "passed" or "holding" """
@@ -209,6 +379,23 @@ class CardInstance(InGameModel):
         dict_["card"] = self.card.to_dict()
         return dict_
 
+    def payload(self, fields=None) -> dict:
+        """JSON-ready dict of this card instance, as sent to clients. The card
+        comes from Card.payload. Pass `fields` to only include those keys"""
+        state = self.state
+        dict_ = model_to_dict(mtd_original(self, recurse=False))
+        dict_["status"] = self.status
+        dict_["card"] = self.card.payload()
+        dict_["player"] = state.player_summary(self.player_id)
+        if self.from__id is not None:
+            dict_["from_"] = {
+                "id_": self.from__id,
+                "player": state.player_summary(self.from_.player_id),
+            }
+        if fields is not None:
+            dict_ = {key: dict_[key] for key in fields if key in dict_}
+        return dict_
+
     def set_dynamic(self):
         """Replaces variables with dynamic data"""
         start_index = self.card.description.find("(")
@@ -264,6 +451,7 @@ class CardInstance(InGameModel):
     def create_fake_news(self, fake: Card):
         """Changes the details of the card"""
         assert fake in self.card.fakes
+        original_id = self.card_id
         self.card = fake
         self.card.faked_by = self.player
         self.card.original_player = self.player
@@ -273,20 +461,15 @@ class CardInstance(InGameModel):
             self.card.bias_against = color
             self.card.save()
         self.save()
+        self.state.remove_card_holder(original_id, self.clone, self.player_id)
+        self.state.cache_card_instance(self)
 
     def allowed_recipients(self):
-        """Returns a list of players to whom this card can be passed"""
-        # TODO optimise
-        # Can select only certain fields
-        card_instances = (
-            CardInstance.select(CardInstance.player_id)
-            .where(CardInstance.card == self.card)
-            .where(CardInstance.clone == self.clone)
-        )
-
-        completed_player_ids = [ci.player_id for ci in card_instances]
-        select_args = []
-
-        # add cancelled player
-
-        return self.game.player_set.where(~Player.id_.in_(completed_player_ids))
+        """Returns a list of players to whom this card can be passed - the
+        players who never got an instance of this card (and clone)"""
+        holders = self.state.card_holders(self.card_id, self.clone)
+        return [
+            player
+            for player in self.state.ordered_players()
+            if player.id_ not in holders
+        ]
@@ -19,42 +19,47 @@ class PlayerCardQueue(InGameModel):
     )
     active = peewee.BooleanField(default=True)
 
+    class Meta:
+        indexes = ((("player", "active", "idx"), False),)
+
     @classmethod
     def queue(cls, card_instance):
-        """Adds a card instance to given player's card queue"""
-        # TODO atomic
-        query = (
-            cls.select()
-            .where(cls.player == card_instance.player)
-            .order_by(cls.idx.desc())
-            .limit(1)
-        )
-        if query.count() == 1:
-            idx = query.first().idx + 1
-        else:
-            idx = 0
-        saved = cls.create(
+        """Adds a card instance to given player's card queue.
+
+        The game state hands out the position in the queue, so two cards
+        passed to the same player at once can't get the same idx"""
+        state = card_instance.state
+        idx = state.enqueue(card_instance)
+        item = cls(
             idx=idx,
-            player=card_instance.player,
-            game=card_instance.game,
-            card_instance=card_instance,
+            player=card_instance.player_id,
+            game=card_instance.game_id,
+            card_instance=card_instance.id_,
         )
-        return saved
+        state.write(cls.insert(item.__data__))
+        return item
 
     @classmethod
     def dequeue(cls, card_instance):
         """Sets a card queue instance to active == false"""
-        cls.update(active=False).where(cls.card_instance == card_instance).where(
-            cls.active == True
-        ).execute()
+        state = card_instance.state
+        state.dequeue(card_instance)
+        state.write(
+            cls.update(active=False)
+            .where(cls.card_instance == card_instance)
+            .where(cls.active == True)
+        )
 
     @classmethod
     def mark_as_fake(cls, card):
         """Dequeues all instances for a given card"""
-        ids = [
-            x.id_
-            for x in cls.select(cls.id_)
-            .join(CardInstance)
-            .where(CardInstance.card == card)
-        ]
-        cls.update(active=False).where(cls.id_.in_(ids))
+        state = card.state
+        state.dequeue_card(card.id_)
+        instances = CardInstance.select(CardInstance.id_).where(
+            CardInstance.card == card
+        )
+        state.write(
+            cls.update(active=False)
+            .where(cls.card_instance.in_(instances))
+            .where(cls.active == True)
+        )
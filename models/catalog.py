@@ -0,0 +1,183 @@
+"""Shared card and encyclopedia catalog
+
+Every game used to import cards.json and articles.json row by row. Cards
+only differ between games in what happens to them while a game is played,
+so the files are now imported once per version into a catalog of their
+own:
+
+- CatalogCard holds everything a card is printed with - its text, image,
+  topic, color and fakes
+- CatalogArticle (models/encyclopedia.py) holds the encyclopedia articles,
+  linked to catalog cards. Games read them straight from the catalog
+
+A game's Card rows are a slim overlay of the catalog: besides a link to the
+catalog card, they only hold what changes per game - the game's topic and
+color, who drew or faked the card, whether it was discarded. Text fields
+are left NULL and read from the catalog card, unless a game changed them
+(eg. the dynamic description filled in by CardInstance.set_dynamic).
+"""
+import hashlib
+import json
+
+import peewee
+
+from .base import Model, Game, db
+
+# Part of every catalog version - bumped whenever catalogs are stored
+# differently, so that catalogs of an older layout are imported again
+CATALOG_FORMAT = b"2"
+
+
+class Catalog(Model):
+    """A version of the card and encyclopedia files, imported once"""
+
+    # Hash of the contents of the card and encyclopedia files
+    version = peewee.CharField(unique=True, max_length=64)
+
+    @staticmethod
+    def file_version(*filepaths) -> str:
+        """Hashes the contents of the given files"""
+        digest = hashlib.sha256(CATALOG_FORMAT)
+        for filepath in filepaths:
+            with open(filepath, "rb") as infile:
+                digest.update(infile.read())
+        return digest.hexdigest()
+
+    @classmethod
+    def get_or_build(cls, cards_filepath: str, encyclopedia_filepath: str):
+        """Returns the catalog for the given files. It is imported the first
+        time this version of the files is seen"""
+        version = cls.file_version(cards_filepath, encyclopedia_filepath)
+        catalog = cls.select().where(cls.version == version).first()
+        if catalog:
+            return catalog
+
+        try:
+            with db.atomic():
+                return cls.build(version, cards_filepath, encyclopedia_filepath)
+        except peewee.IntegrityError:
+            # Built by someone else in the meantime
+            return cls.get(cls.version == version)
+
+    @classmethod
+    def build(cls, version: str, cards_filepath: str, encyclopedia_filepath: str):
+        """Imports the card and encyclopedia files into a new catalog"""
+        from .encyclopedia import CatalogArticle
+
+        catalog = cls.create(version=version)
+        CatalogCard.import_from_json(
+            json_path=cards_filepath, defaults={"catalog_id": catalog.id_}
+        )
+        CatalogArticle.import_from_json(
+            json_path=encyclopedia_filepath, defaults={"catalog_id": catalog.id_}
+        )
+        return catalog
+
+    def copy_cards_to(self, game: Game):
+        """Adds the catalog's cards to `game`. The game's topics and colors
+        must already exist"""
+        from .counters import Color
+        from .card import Card
+
+        # Bias cards may be against communities that don't play the game
+        # (eg. yellow)
+        colors = (
+            CatalogCard.select(CatalogCard.bias_against)
+            .where(CatalogCard.catalog == self)
+            .where(CatalogCard.bias_against.is_null(False))
+            .distinct()
+        )
+        for card in colors:
+            Color.get_or_create(name=card.bias_against, game=game)
+
+        Card.copy_from_catalog(self, game)
+
+
+class CatalogCard(Model):
+    """A card as printed in a version of cards.json. Never changes"""
+
+    catalog = peewee.ForeignKeyField(Catalog)
+    title = peewee.CharField()
+    description = peewee.TextField()
+    # Topic and color names - each game links its cards to its own
+    affinity_towards = peewee.CharField(null=True)
+    affinity_count = peewee.IntegerField(null=True)
+    bias_against = peewee.CharField(null=True)
+    fake = peewee.BooleanField(default=False)
+    original = peewee.ForeignKeyField("self", backref="fakes", null=True)
+    tgb = peewee.IntegerField(null=True)
+    storyline = peewee.CharField(default="none")
+    storyline_index = peewee.IntegerField(default=0)
+    image = peewee.FixedCharField(default="", max_length=50)
+
+    # Catalog cards are read by every game, so they are kept in memory once
+    # read. id -> CatalogCard
+    cache = {}
+
+    @classmethod
+    def cached(cls, id_: str):
+        """Returns the catalog card `id_`. The first one asked for reads all
+        cards of its catalog"""
+        card = cls.cache.get(id_)
+        if card is None:
+            catalog = cls.select(cls.catalog).where(cls.id_ == id_)
+            for card in cls.select().where(cls.catalog.in_(catalog)):
+                cls.cache[card.id_] = card
+            card = cls.cache[id_]
+        return card
+
+    @classmethod
+    def from_dict(cls, dict_, defaults):
+        """Returns the unsaved card described by `dict_`, followed by its
+        fakes. Returns an empty list if the card has no description"""
+        fakes = dict_.pop("fakes", [])
+        dict_.update(defaults)
+        if not dict_.get("description"):
+            return []
+
+        card = cls(**dict_)
+        cards = [card]
+        for fake in fakes:
+            fake["original_id"] = card.id_
+            cards += cls.from_dict(fake, defaults)
+        return cards
+
+    @classmethod
+    def import_from_json(cls, json_dict=None, json_path=None, defaults=None):
+        """Creates the cards and their fakes, in batches"""
+        if not json_dict:
+            with open(json_path) as infile:
+                json_dict = json.load(infile)
+
+        cards = []
+        for dict_ in json_dict:
+            cards += cls.from_dict(dict_, defaults)
+        cls.bulk_insert(cards)
+
+
+class CatalogFieldAccessor(peewee.FieldAccessor):
+    """Reads a field of the catalog card while the row's own value is NULL"""
+
+    def __get__(self, instance, instance_type=None):
+        if instance is None:
+            return self.field
+        value = instance.__data__.get(self.name)
+        catalog_card_id = instance.__data__.get("catalog_card")
+        if value is None and catalog_card_id is not None:
+            value = getattr(CatalogCard.cached(catalog_card_id), self.name)
+        return value
+
+
+def from_catalog(field: peewee.Field) -> peewee.Field:
+    """Makes `field` of a model with a `catalog_card` foreign key fall back
+    to the catalog card's value of the same name. Such fields must be
+    nullable"""
+    field.accessor_class = CatalogFieldAccessor
+    return field
+
+
+def copied_id(game: Game, catalog_id):
+    """ID of a game's copy of a catalog row. It is derived from the catalog
+    row's ID so that links between rows (eg. fake -> original) can be copied
+    without looking anything up"""
+    return peewee.fn.MD5(peewee.fn.CONCAT(game.id_, catalog_id))
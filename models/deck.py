@@ -0,0 +1,105 @@
+"""Pre-shuffled deck of a game
+
+The draw functions pick a random undrawn card out of one of five categories.
+Instead of sorting the card table randomly on every draw, the undrawn cards
+of a game are read once, split into buckets and shuffled. A draw then pops a
+card off a bucket.
+
+Buckets are keyed by (bias_against, tgb) within a category, so that the
+tgb threshold and the excluded communities of a draw only decide which
+buckets are eligible.
+"""
+import random
+
+TRUE_TOPICAL = "true_topical"
+TRUE_AFFINITY = "true_affinity"
+FAKE_TOPICAL = "fake_topical"
+FAKE_AFFINITY = "fake_affinity"
+BIAS = "bias"
+
+CATEGORIES = [TRUE_TOPICAL, TRUE_AFFINITY, FAKE_TOPICAL, FAKE_AFFINITY, BIAS]
+
+
+class Deck:
+    """The undrawn cards of a game, by category"""
+
+    def __init__(self, cards):
+        # category -> {(bias_against id, tgb): [card ids in random order]}
+        self.buckets = {category: {} for category in CATEGORIES}
+        for card in cards:
+            key = (card.bias_against_id, card.tgb)
+            self.buckets[self.category(card)].setdefault(key, []).append(card.id_)
+        for buckets in self.buckets.values():
+            for bucket in buckets.values():
+                random.shuffle(bucket)
+
+    @classmethod
+    def load(cls, game):
+        """Builds the deck from the cards of `game` which can still be drawn"""
+        from .card import Card
+
+        cards = (
+            Card.select(
+                Card.id_,
+                Card.affinity_towards,
+                Card.bias_against,
+                Card.fake,
+                Card.tgb,
+            )
+            .where(Card.game == game)
+            .where(Card.original_player.is_null())
+            .where(Card.faked_by.is_null())
+        )
+        return cls(cards)
+
+    @staticmethod
+    def category(card) -> str:
+        """Returns which category a card is drawn from"""
+        if card.bias_against_id is not None:
+            return BIAS
+        if card.affinity_towards_id is not None:
+            return FAKE_AFFINITY if card.fake else TRUE_AFFINITY
+        return FAKE_TOPICAL if card.fake else TRUE_TOPICAL
+
+    def _eligible(self, category, max_tgb=None, exclude_colors=()):
+        """Returns the non-empty buckets a draw can pick from"""
+        return [
+            bucket
+            for (color_id, tgb), bucket in self.buckets[category].items()
+            if bucket
+            and color_id not in exclude_colors
+            and (max_tgb is None or (tgb is not None and tgb <= max_tgb))
+        ]
+
+    def count(self, category, max_tgb=None, exclude_colors=()) -> int:
+        """Number of cards a draw can pick from"""
+        return sum(
+            len(bucket) for bucket in self._eligible(category, max_tgb, exclude_colors)
+        )
+
+    def pop(self, category, max_tgb=None, exclude_colors=()):
+        """Removes a random card id out of the eligible buckets and returns it.
+        Returns None if there are no cards left.
+
+        `max_tgb` - only cards with a tgb lower than or equal to this
+        `exclude_colors` - ids of colors whose bias cards are skipped
+        """
+        eligible = self._eligible(category, max_tgb, exclude_colors)
+        if not eligible:
+            return None
+        # Every card is equally likely - pick a bucket by its size. Buckets
+        # are shuffled, so the last card is as good as any other
+        bucket = random.choices(eligible, weights=[len(b) for b in eligible])[0]
+        return bucket.pop()
+
+    def draw(self, category, max_tgb=None, exclude_colors=()):
+        """Pops and returns a Card. Cards which were drawn or faked behind the
+        deck's back (eg. by a test script) are skipped. Returns None if there
+        are no cards left"""
+        from .card import Card
+
+        while (card_id := self.pop(category, max_tgb, exclude_colors)) is not None:
+            card = Card.get_or_none(Card.id_ == card_id)
+            if card and card.original_player_id is None and card.faked_by_id is None:
+                return card
+        return None
@@ -2,11 +2,33 @@ import json
 
 import peewee
 
-from .base import InGameModel
+from .base import InGameModel, Model
 from .card import Card
+from .catalog import Catalog, CatalogCard
 
 
-class Article(InGameModel):
+class Rendered:
+    """Renders the true or the fake version of an article"""
+
+    def render(self, fake: bool):
+        """Returns either the true or fake article depending on the `fake` argument"""
+        if fake and self.fake_content and self.fake_type_ and self.fake_author:
+            return {
+                "title": self.title,
+                "content": self.fake_content,
+                "type": self.fake_type_,
+                "author": self.fake_author,
+            }
+
+        return {
+            "title": self.title,
+            "content": self.content,
+            "type": self.type_,
+            "author": self.author,
+        }
+
+
+class Article(Rendered, InGameModel):
     title = peewee.TextField(null=True)
     content = peewee.TextField(null=True)
     type_ = peewee.CharField(null=True)
@@ -21,42 +43,73 @@ class Article(InGameModel):
 
     @classmethod
     def import_from_json(cls, json_dict=None, json_path=None, defaults=None):
-        """First creates the original cards, then the fakes"""
+        """Creates the articles whose title is the description of one of the
+        game's cards, linked to that card"""
         if not json_dict:
             with open(json_path) as infile:
                 json_dict = json.load(infile)
 
         game_id = defaults["game_id"]
+        # Titles are matched the way MySQL compares strings - ignoring case
+        # and surrounding spaces
+        cards = {}
+        for card in Card.select(Card.id_, Card.description).where(
+            Card.game_id == game_id
+        ):
+            cards.setdefault(cls.match_key(card.description), card.id_)
+
         new_ = []
-        for idx in range(len(json_dict)):
-            dict_ = json_dict[idx]
-            title = dict_["title"]
-            card = (
-                Card.select()
-                .where(Card.game_id == game_id)
-                .where(Card.description == title.strip())
-                .first()
-            )
-            if not card:
+        for dict_ in json_dict:
+            card_id = cards.get(cls.match_key(dict_["title"]))
+            if not card_id:
                 continue
-            dict_["card_id"] = card.id_
+            dict_["card_id"] = card_id
             new_.append(dict_)
 
         super().import_from_json(json_dict=new_, defaults=defaults)
 
-    def render(self, fake: bool):
-        """Returns either the true or fake article depending on the `fake` argument"""
-        if fake and self.fake_content and self.fake_type_ and self.fake_author:
-            return {
-                "title": self.title,
-                "content": self.fake_content,
-                "type": self.fake_type_,
-                "author": self.fake_author,
-            }
+    @staticmethod
+    def match_key(text: str) -> str:
+        return text.strip().casefold()
 
-        return {
-            "title": self.title,
-            "content": self.content,
-            "type": self.type_,
-            "author": self.author,
-        }
+
+class CatalogArticle(Rendered, Model):
+    """An article of a version of articles.json, shared by all games created
+    from its catalog (see models/catalog.py)"""
+
+    catalog = peewee.ForeignKeyField(Catalog)
+    title = peewee.TextField(null=True)
+    content = peewee.TextField(null=True)
+    type_ = peewee.CharField(null=True)
+    author = peewee.CharField(null=True)
+    fake_content = peewee.TextField(null=True)
+    fake_type_ = peewee.CharField(null=True)
+    fake_author = peewee.CharField(null=True)
+    is_fake = peewee.BooleanField(null=True)
+    card = peewee.ForeignKeyField(
+        CatalogCard, null=True, unique=True, backref="encyclopedia_article"
+    )
+
+    @classmethod
+    def import_from_json(cls, json_dict=None, json_path=None, defaults=None):
+        """Creates the articles whose title is the description of one of the
+        catalog's cards, linked to that card"""
+        if not json_dict:
+            with open(json_path) as infile:
+                json_dict = json.load(infile)
+
+        cards = {}
+        for card in CatalogCard.select(CatalogCard.id_, CatalogCard.description).where(
+            CatalogCard.catalog_id == defaults["catalog_id"]
+        ):
+            cards.setdefault(Article.match_key(card.description), card.id_)
+
+        new_ = []
+        for dict_ in json_dict:
+            card_id = cards.get(Article.match_key(dict_["title"]))
+            if not card_id:
+                continue
+            dict_["card_id"] = card_id
+            new_.append(dict_)
+
+        super().import_from_json(json_dict=new_, defaults=defaults)
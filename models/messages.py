@@ -34,7 +34,15 @@ class OutgoingMessage(object):
 HEARTBEAT = OutgoingMessage(
     name="heartbeat",
     can_send_to=OutgoingMessage.TO_ANY,
-    message_template={"data": "heartbeat", "count": "{integer}"},
+    # version is the latest about_game version - clients behind it resync
+    # with the about_game request
+    message_template={
+        "data": {
+            "version": "{integer}",
+            "joined": "{integer}",
+            "player_count": "{integer}",
+        }
+    },
 )
 
 ERROR_GENERIC = OutgoingMessage(
@@ -110,6 +118,26 @@ REPLY_ABOUT_GAME = OutgoingMessage(
     },
 )
 
+ABOUT_GAME = OutgoingMessage(
+    name="about_game",
+    can_send_to=[OutgoingMessage.TO_GAME],
+    message_template={"data": "{full_about_game_document_with_version}"},
+)
+
+ABOUT_GAME_DELTA = OutgoingMessage(
+    name="about_game_delta",
+    can_send_to=[OutgoingMessage.TO_GAME],
+    message_template={
+        "data": {
+            "version": "{integer}",
+            "changes": {
+                "{changed_field}": "{new_value}",
+                "players": {"{player_id}": {"{changed_field}": "{new_value}"}},
+            },
+        }
+    },
+)
+
 REPLY_CREATED_GAME = OutgoingMessage(
     can_send_to=[OutgoingMessage.TO_SENDER],
     message_template={
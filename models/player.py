@@ -49,6 +49,8 @@ class Player(InGameModel):
 
     client_id = peewee.CharField(null=True)
     current = peewee.BooleanField(default=False)
+    # Current powers, one bit per power (see models/powers.py)
+    power_flags = peewee.IntegerField(default=0)
 
     class Meta:
         # Unique together
@@ -59,11 +61,11 @@ class Player(InGameModel):
 
     def bias(self, against: Color) -> int:
         """Returns the bias of this player against a given color"""
-        return Score.bias(self.score_set, against)
+        return Score.bias(self, against)
 
     def affinity(self, towards: AffinityTopic) -> int:
         """Returns the bias of this player against a given color"""
-        return Score.affinity(self.score_set, towards)
+        return Score.affinity(self, towards)
 
     def affinity_matches(self, with_, towards: AffinityTopic) -> bool:
         """Returns True if self's affinity matches with `with_`'s affinity
@@ -81,10 +83,10 @@ class Player(InGameModel):
         return self.bias(against=against) * with_.bias(against=against) >= 1
 
     def all_affinities(self):
-        return Score.all_affinities(self.score_set)
+        return Score.all_affinities(self)
 
     def all_biases(self):
-        return Score.all_biases(self.score_set)
+        return Score.all_biases(self)
 
     def card_instances_in_hand(self):
         """Retuns all card instances which the player is holding"""
@@ -99,7 +101,7 @@ class Player(InGameModel):
         PlayerCardQueue.queue(card_instance)
 
     def clout(self):
-        return Score.clout(self.score_set)
+        return Score.clout(self)
 
     def action_keep_card(self, card_instance_id: str, discard=False):
         """Remove this card from the queue"""
@@ -391,18 +393,17 @@ class Player(InGameModel):
     def action_encyclopedia_search(self, card_id):
         """Returns this card's encyclopedia article"""
         from .card import Card
-        from .encyclopedia import Article
 
         card = Card.select().where(Card.id_ == card_id, Card.game == self.game).first()
         if not card:
             raise Exception("Encyclopedia Search : Card Not Found")
         if card.fake:
             if card.original:
-                article = card.original.encyclopedia_article.first()
+                article = card.original.article()
             else:
-                article = card.encyclopedia_article.first()
+                article = card.article()
         else:
-            article = card.encyclopedia_article.first()
+            article = card.article()
         if article:
             return article.render(fake=card.fake)
         return {}
@@ -459,13 +460,7 @@ class Player(InGameModel):
     def get_queued_card_instance(self):
         """Returns the oldest card instance queued. Returns None if no cards
         are queued"""
-        from .card_queue import PlayerCardQueue
-
-        query = self.card_queue_items.where(PlayerCardQueue.active == True)
-
-        oldest = query.order_by(PlayerCardQueue.idx).first()
-        if oldest:
-            return oldest.card_instance
+        return self.state.queue_head(self.id_)
 
     def get_pending_cancel_vote(self):
         """Returns the oldest pending vote (for cancellation) for this player"""
@@ -489,7 +484,7 @@ class Player(InGameModel):
         """Returns a list of topics this player can use to initiate cancel"""
         return [
             topic
-            for topic in self.game.affinitytopic_set
+            for topic in self.state.topics
             if abs(self.affinity(towards=topic)) >= CANCELLING_AFFINITY_COUNT
         ]
 
@@ -502,37 +497,35 @@ class Player(InGameModel):
         else:
             return bool(self.valid_topics_for_cancel())
 
+    def compute_powers(self) -> dict:
+        """Returns {power name: active} for this player, worked out from
+        their largest affinity and bias"""
+        from .powers import VIRAL_SPIRAL, CANCEL, FAKE_NEWS
+
+        state = self.state
+        max_affinity = max(
+            map(abs, state.scores_of_type(self.id_, ScoreType.AFFINITY.value).values()),
+            default=0,
+        )
+        max_bias = max(
+            map(abs, state.scores_of_type(self.id_, ScoreType.BIAS.value).values()),
+            default=0,
+        )
+        return {
+            VIRAL_SPIRAL: (
+                max_affinity >= VIRAL_SPIRAL_AFFINITY_COUNT
+                or max_bias >= VIRAL_SPIRAL_BIAS_COUNT
+            ),
+            CANCEL: max_affinity >= CANCELLING_AFFINITY_COUNT,
+            FAKE_NEWS: max_bias >= FAKE_NEWS_BIAS_COUNT,
+        }
+
     def update_powers(self):
         """Updates the powers of this player"""
-        from .powers import VIRAL_SPIRAL, CANCEL, FAKE_NEWS, PlayerPower
-
-        # TODO Optimise this to reuse the computations across powers
-
-        # Viral Spiral
-        viral_spiral_affinity_check = False
-        viral_spiral_bias_check = False
-        for topic in self.game.affinitytopic_set:
-            if abs(self.affinity(towards=topic)) >= VIRAL_SPIRAL_AFFINITY_COUNT:
-                viral_spiral_affinity_check = True
-                break
-        for color in self.game.color_set:
-            if abs(self.bias(against=color)) >= VIRAL_SPIRAL_BIAS_COUNT:
-                viral_spiral_bias_check = True
-                break
-        has_viral_spiral = viral_spiral_affinity_check or viral_spiral_bias_check
-        PlayerPower.update(name=VIRAL_SPIRAL, player=self, active=has_viral_spiral)
-
-        # Cancel
-        has_cancel = self.has_initiate_cancel()
-        PlayerPower.update(name=CANCEL, player=self, active=has_cancel)
-
-        # Fake News
-        has_fake_news = False
-        for color in self.game.color_set:
-            if abs(self.bias(against=color)) >= FAKE_NEWS_BIAS_COUNT:
-                has_fake_news = True
-                break
-        PlayerPower.update(name=FAKE_NEWS, player=self, active=has_fake_news)
+        from .powers import PlayerPower
+
+        for name, active in self.compute_powers().items():
+            PlayerPower.update(name=name, player=self, active=active)
 
 
 """
@@ -560,127 +553,83 @@ class Score(InGameModel):
 
     @classmethod
     def initialize(cls, game: Game, player: Player):
-        Score.create(game=game, player=player, type=ScoreType.CLOUT.value)
-        for affinity in game.affinitytopic_set:
-            Score.create(
-                game=game,
-                player=player,
-                type=ScoreType.AFFINITY.value,
-                target=affinity.id_,
-            )
-        for bias in game.color_set:
-            if bias != player.color:
-                Score.create(
-                    game=game, player=player, type=ScoreType.BIAS.value, target=bias.id_
-                )
+        """Creates the whole score vector of a player with a single insert"""
+        state = game.state
+        targets = [(ScoreType.CLOUT.value, None)]
+        for affinity in state.topics:
+            targets.append((ScoreType.AFFINITY.value, affinity.id_))
+        for bias in state.colors:
+            if bias.id_ != player.color_id:
+                targets.append((ScoreType.BIAS.value, bias.id_))
+
+        Score.insert_many(
+            [
+                {
+                    Score.game: game,
+                    Score.player: player,
+                    Score.type: type_,
+                    Score.target: target,
+                    Score.value: 0,
+                }
+                for type_, target in targets
+            ]
+        ).execute()
+        for type_, target in targets:
+            state.add_score(player.id_, type_, target)
 
     @classmethod
     def inc_bias(cls, player: Player, color: Color, inc: int):
-        (
-            Score.update({Score.value: Score.value + inc})
-            .where(Score.game == player.game)
-            .where(Score.player == player)
-            .where(Score.target == color.id_)
-            .where(Score.type == ScoreType.BIAS.value)
-            .execute()
-        )
+        player.state.inc_score(player.id_, ScoreType.BIAS.value, color.id_, inc)
 
     @classmethod
     def inc_affinity(cls, player: Player, affinity: AffinityTopic, inc: str):
-        current_affinity = player.affinity(towards=affinity)
-
         if inc == "penalty":
-            if current_affinity > 0:
-                (
-                    Score.update({Score.value: Score.value - 1})
-                    .where(Score.game == player.game)
-                    .where(Score.player == player)
-                    .where(Score.target == affinity.id_)
-                    .where(Score.type == ScoreType.AFFINITY.value)
-                    .execute()
-                )
-            else:
-                (
-                    Score.update({Score.value: Score.value + 1})
-                    .where(Score.game == player.game)
-                    .where(Score.player == player)
-                    .where(Score.target == affinity.id_)
-                    .where(Score.type == ScoreType.AFFINITY.value)
-                    .execute()
-                )
-
+            # The penalty always moves the affinity towards 0
+            inc = -1 if player.affinity(towards=affinity) > 0 else 1
         else:
-            (
-                Score.update({Score.value: Score.value + int(inc)})
-                .where(Score.game == player.game)
-                .where(Score.player == player)
-                .where(Score.target == affinity.id_)
-                .where(Score.type == ScoreType.AFFINITY.value)
-                .execute()
-            )
+            inc = int(inc)
+
+        player.state.inc_score(
+            player.id_, ScoreType.AFFINITY.value, affinity.id_, inc
+        )
 
     @classmethod
     def inc_clout(cls, player: Player, inc: int):
-        clout = Score.clout(player.score_set)
-        new_clout = 0 if clout + inc < 0 else clout + inc
-        (
-            Score.update({Score.value: new_clout})
-            .where(Score.game == player.game)
-            .where(Score.player == player)
-            .where(Score.type == ScoreType.CLOUT.value)
-            .execute()
-        )
+        # Clout never goes below 0
+        player.state.inc_score(player.id_, ScoreType.CLOUT.value, None, inc, minimum=0)
 
     """
         A helper method to format scores in a way thats backwards compatible
         with what the client expects 
+
+        All the lookups below are served from the player's score vector
+        in the game state, which is loaded once per game
     """
 
     @classmethod
-    def all_scores_for_client(cls, scores: peewee.ModelSelect):
-        all_scores = {"score": 0, "biases": {}, "affinities": {}}
-        for score in scores:
-            if score.type == ScoreType.CLOUT.value:
-                all_scores["score"] = score.value
-            elif score.type == ScoreType.BIAS.value:
-                all_scores["biases"][score.target] = score.value
-            elif score.type == ScoreType.AFFINITY.value:
-                all_scores["affinities"][score.target] = score.value
-        return all_scores
+    def all_scores_for_client(cls, player: Player):
+        return {
+            "score": cls.clout(player),
+            "biases": cls.all_biases(player),
+            "affinities": cls.all_affinities(player),
+        }
 
     @classmethod
-    def all_biases(cls, scores: peewee.ModelSelect):
-        all_biases = {}
-        for score in scores:
-            if score.type == ScoreType.BIAS.value:
-                all_biases[score.target] = score.value
-        return all_biases
+    def all_biases(cls, player: Player):
+        return player.state.scores_of_type(player.id_, ScoreType.BIAS.value)
 
     @classmethod
-    def all_affinities(cls, scores: peewee.ModelSelect):
-        all_affinities = {}
-        for score in scores:
-            if score.type == ScoreType.AFFINITY.value:
-                all_affinities[score.target] = score.value
-        return all_affinities
+    def all_affinities(cls, player: Player):
+        return player.state.scores_of_type(player.id_, ScoreType.AFFINITY.value)
 
     @classmethod
-    def bias(cls, scores: peewee.ModelSelect, color: Color):
-        for score in scores:
-            if score.type == ScoreType.BIAS.value and score.target == color.id_:
-                return score.value
-        return 0
+    def bias(cls, player: Player, color: Color):
+        return player.state.score(player.id_, ScoreType.BIAS.value, color.id_)
 
     @classmethod
-    def affinity(cls, scores: peewee.ModelSelect, affinity: AffinityTopic):
-        for score in scores:
-            if score.type == ScoreType.AFFINITY.value and score.target == affinity.id_:
-                return score.value
-        return 0
+    def affinity(cls, player: Player, affinity: AffinityTopic):
+        return player.state.score(player.id_, ScoreType.AFFINITY.value, affinity.id_)
 
     @classmethod
-    def clout(cls, scores: peewee.ModelSelect):
-        for score in scores:
-            if score.type == ScoreType.CLOUT.value:
-                return score.value
-        return 0
+    def clout(cls, player: Player):
+        return player.state.score(player.id_, ScoreType.CLOUT.value)
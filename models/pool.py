@@ -0,0 +1,111 @@
+"""Pooled database connections
+
+Every greenlet (a websocket request, a game loop) gets its own connection
+out of a shared pool and hands it back when it is done, instead of opening
+a new connection to MySQL each time. Connections are pinged before they
+are handed out, and recycled once they are older than the stale timeout.
+
+How long greenlets wait for a connection is recorded, so that a pool which
+is too small shows up (see `PoolMetrics`), and the queries a greenlet
+runs can be counted (see `count_queries`).
+"""
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from playhouse.pool import MaxConnectionsExceeded, PooledMySQLDatabase
+
+
+class PoolMetrics:
+    """How long connections were waited for"""
+
+    def __init__(self):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def record(self, wait: float):
+        self.checkouts += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+
+    def to_dict(self) -> dict:
+        return {
+            "checkouts": self.checkouts,
+            "timeouts": self.timeouts,
+            "avg_wait_ms": (
+                self.total_wait / self.checkouts * 1000 if self.checkouts else 0
+            ),
+            "max_wait_ms": self.max_wait * 1000,
+        }
+
+
+class MeteredPooledMySQLDatabase(PooledMySQLDatabase):
+    """A MySQL connection pool which records how long connections take to
+    check out. PooledMySQLDatabase already pings a connection before
+    reusing it and throws it away if the ping fails"""
+
+    def __init__(self, *args, **kwargs):
+        self.metrics = PoolMetrics()
+        self._counting = threading.local()
+        super().__init__(*args, **kwargs)
+
+    def execute_sql(self, sql, params=None, *args, **kwargs):
+        if (counter := getattr(self._counting, "counter", None)) is not None:
+            counter.queries += 1
+        return super().execute_sql(sql, params, *args, **kwargs)
+
+    @contextmanager
+    def count_queries(self, counter):
+        """Adds the number of queries the calling greenlet runs inside the
+        block to `counter.queries`"""
+        previous = getattr(self._counting, "counter", None)
+        self._counting.counter = counter
+        try:
+            yield counter
+        finally:
+            self._counting.counter = previous
+
+    def connect(self, reuse_if_open=False):
+        if not self.is_closed():
+            return super().connect(reuse_if_open)
+
+        start = time.perf_counter()
+        try:
+            return super().connect(reuse_if_open)
+        except MaxConnectionsExceeded:
+            self.metrics.timeouts += 1
+            raise
+        finally:
+            self.metrics.record(time.perf_counter() - start)
+
+    def status(self) -> dict:
+        """Size of the pool and how long connections were waited for"""
+        return {
+            "max_connections": self._max_connections,
+            "in_use": len(self._in_use),
+            "idle": len(self._connections),
+            **self.metrics.to_dict(),
+        }
+
+    def release(self):
+        """Hands the calling greenlet's connection back to the pool. Call
+        this before a greenlet waits or sleeps, so that idle games don't
+        hold on to connections. Does nothing inside a transaction"""
+        if not self.is_closed() and not self.in_transaction():
+            self.close()
+
+    def connection_scope(self, func):
+        """Decorator - runs `func` with a connection which is handed back to
+        the pool when it returns"""
+
+        @wraps(func)
+        def wrapped(*args, **kwargs):
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.release()
+
+        return wrapped
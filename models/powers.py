@@ -4,6 +4,7 @@ import peewee
 from .base import InGameModel, Game, Round, db, model_id_generator, FullRound
 from .player import Player
 from .counters import AffinityTopic
+from .audit import AuditLog
 
 from constants import ACTIVE_STR, CANCEL_VOTE_ALL_PLAYERS, CANCELLING_ALLOW_POLL
 from exceptions import NotFound, DuplicateAction
@@ -14,14 +15,20 @@ FAKE_NEWS = "fake_news"
 
 ALL_POWERS = [VIRAL_SPIRAL, CANCEL, FAKE_NEWS]
 
+# Bit of each power in Player.power_flags
+POWER_FLAGS = {VIRAL_SPIRAL: 1, CANCEL: 2, FAKE_NEWS: 4}
+
 
 class PlayerPower(InGameModel):
     """The name is the name of the power
     Player is the player
-    created_at is used to maintain historic count. The latest created_on is the current
-        power status
+    created_at is used to maintain historic count. The latest created_on is the
+        power status at that point
     active = True means the player has this power
     active = False means the player does not have this power
+
+    This is an append-only log of changes, written in the background. The
+    current powers of a player are kept in Player.power_flags
     """
 
     name = peewee.CharField()
@@ -29,29 +36,30 @@ class PlayerPower(InGameModel):
     active = peewee.BooleanField()
 
     class Meta:
-        # Unique together
-        indexes = ((("name", "player", "game", "created_at"), True),)
+        indexes = ((("player", "created_at"), False),)
 
     @classmethod
     def get_latest(cls, name: str, player: Player):
+        """Returns the current status of a power. Served from the game state,
+        so the returned object is not necessarily a saved row"""
         assert name in ALL_POWERS
-        power = (
-            player.powers.where(cls.name == name)
-            .order_by(cls.created_at.desc())
-            .first()
-        )
-        if not power:
-            power = cls(name=name, player=player, active=False)
-        return power
+        active = player.state.power(player.id_, name)
+        return cls(name=name, player=player, active=bool(active))
 
     @classmethod
     def update(cls, name: str, player: Player, active: bool):
-        # TODO No need to update if power hasn't changed
+        """Records the status of a power - if it changed"""
         assert name in ALL_POWERS
-        try:
-            cls.create(name=name, player=player, active=active, game=player.game)
-        except peewee.IntegrityError:
-            pass
+        state = player.state
+        if state.power(player.id_, name) == active:
+            return
+        state.set_power(player.id_, name, active)
+        power_log.append(
+            name=name, player=player.id_, active=active, game=player.game_id
+        )
+
+
+power_log = AuditLog(PlayerPower)
 
 
 class CancelStatus(InGameModel):
@@ -73,60 +81,46 @@ class CancelStatus(InGameModel):
 
     @classmethod
     def cancelled(cls, player: Player):
-        """Returns True if this player has been cancelled in the previous FullRound"""
+        """Returns True if this player has been cancelled in the previous or
+        the current FullRound, and the cancellation wasn't carried out yet.
+        The cancellation is marked as carried out. As before, any final
+        status but 0 counts - including a vote that is still open (-1)"""
         try:
             current_full_round = player.game.current_round.full_round
             previous_full_round = current_full_round.previous()
         except FullRound.DoesNotExist:
-            print("Returning at first try")
             return False
 
+        # Nobody is cancelled during the first FullRound
         if not previous_full_round:
-            print("Returning at first if")
             return False
+        full_rounds = [previous_full_round.id_, current_full_round.id_]
 
-        prev_rounds = previous_full_round.round_set
-        current_rounds = current_full_round.round_set
-        
-
-        for round_ in prev_rounds:
-            # print(round_.id_)
+        while True:
+            # The oldest round the player was cancelled in
             status = (
-                CancelStatus.select()
-                .where(CancelStatus.round_id == round_.id_)
-                .where(CancelStatus.against_id == player.id_)
-                .where(CancelStatus.power_executed == 0)
+                cls.select(cls.round)
+                .join(Round)
+                .where(Round.full_round.in_(full_rounds))
+                .where(cls.against == player)
+                .where(cls.power_executed == 0)
+                .where(cls.final_status != 0)
+                .order_by(Round.created_at)
                 .first()
             )
-            status_bool= True if status and status.final_status else False
-            if status_bool:
-                CancelStatus.update(power_executed=1).where(CancelStatus.round_id == round_.id_).where(CancelStatus.against_id == player.id_).execute()
-                print("status bool was returned as true!")
-                return status_bool
-
-
-            
-            
-        
-        for round_ in current_rounds:
-            # print(round_.id_)
-            status = (
-                CancelStatus.select()
-                .where(CancelStatus.round_id == round_.id_)
-                .where(CancelStatus.against_id == player.id_)
-                .where(CancelStatus.power_executed == 0)
-                .first()
+            if not status:
+                return False
+
+            # Only one caller gets to carry it out
+            marked = (
+                cls.update(power_executed=1)
+                .where(cls.round == status.round_id)
+                .where(cls.against == player)
+                .where(cls.power_executed == 0)
+                .execute()
             )
-            status_bool = True if status and status.final_status else False
-            if status_bool:
-                CancelStatus.update(power_executed=1).where(CancelStatus.round_id == round_.id_).where(CancelStatus.against_id == player.id_).execute()
-                print("status bool was returned as true!")
-                return status_bool
-            
-            
-         
-        return status_bool
-       
+            if marked:
+                return True
 
     @classmethod
     def initiate(cls, initiator: Player, against: Player, topic: AffinityTopic):
@@ -206,6 +200,28 @@ class CancelVote(InGameModel):
                 game=initiator.game,
             )
 
+    @classmethod
+    def pending_by_voter(cls, game: Game) -> dict:
+        """Returns {voter id: oldest pending vote} for the current round of
+        `game`, with a single query"""
+        current_round = (
+            Round.select(Round.id_)
+            .where(Round.game == game)
+            .order_by(Round.created_at.desc())
+            .limit(1)
+        )
+        votes = (
+            cls.select()
+            .join(CancelStatus)
+            .where(CancelStatus.round == current_round, cls.game == game)
+            .where(cls.vote == -1)
+            .order_by(cls.created_at)
+        )
+        pending = {}
+        for vote in votes:
+            pending.setdefault(vote.voter_id, vote)
+        return pending
+
     @classmethod
     def pending_votes(cls, round_: Round):
         return (
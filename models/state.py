@@ -0,0 +1,375 @@
+"""In-memory state of a running game
+
+A GameState is the authoritative copy of everything the main loop looks at on
+every tick - players, scores, card queues, powers and the card instances
+waiting in those queues. It is loaded from the database once and the models
+mutate it directly as players act.
+
+Writes are handed to the state as peewee queries. By default they run straight
+away; once a game runner owns the state it switches to write-behind and the
+runner flushes the buffered writes in a single transaction. The database is
+then only read back when a game has to be recovered (eg. after a restart).
+
+A GameState is not thread-safe. The main loop and the requests about a game
+take turns with it under the game's lock (see GameRunner.lock_for).
+"""
+import time
+from collections import deque
+
+import peewee
+
+from .base import db
+
+
+class GameState:
+    """Players, scores, queues and powers of a single game"""
+
+    # All loaded states, keyed by game id
+    states = {}
+
+    def __init__(self, game):
+        self.game = game
+        self.players = {}  # player id -> Player
+        self.topics = []
+        self.colors = []
+        self.scores = {}  # player id -> {score type: {target: value}}
+        self.queues = {}  # player id -> deque of card instance ids
+        self.queue_idx = {}  # player id -> idx of the next queued card
+        self.card_payloads = {}  # card id -> Card.payload()
+        # Last about_game broadcast - see Game.about_update. Versions start
+        # from the wall clock in milliseconds, so a game loaded again (eg.
+        # after hibernating or a restart) carries on from a higher version
+        # than any sent before - as long as it broadcast less than 1000
+        # times a second
+        self.about_version = time.time_ns() // 1_000_000
+        self.about_snapshot = None
+        self.about_sent_at = 0
+        self._heartbeat = None  # heartbeat_payload() of the current about version
+        # (card id, clone) -> ids of the players who got an instance of it.
+        # Read from the database the first time a card is asked about
+        self.holders = {}
+        self.card_instances = {}  # card instance id -> queued CardInstance
+        self.power_flags = {}  # player id -> bitmask of active powers
+        self.tgb = 0  # total global bias
+        # Bumped on every score change. Powers are recomputed when the scores
+        # moved on from the version they were computed for
+        self.scores_version = 0
+        self.powers_version = None
+        self._deck = None
+
+        self.write_behind = False
+        self._pending = []
+
+    @classmethod
+    def get(cls, game, load=True):
+        """Returns the state of `game` (a Game or a game id). The state is
+        loaded from the database the first time it is asked for, unless
+        `load` is False - in which case None is returned"""
+        from .base import Game
+
+        game_id = game if isinstance(game, str) else game.id_
+        state = cls.states.get(game_id)
+        if state is None and load:
+            if isinstance(game, str):
+                game = Game.get_by_id(game_id)
+            state = cls(game).load()
+            cls.states[game_id] = state
+        return state
+
+    @classmethod
+    def unload(cls, game):
+        """Flushes and forgets the state of `game`"""
+        game_id = game if isinstance(game, str) else game.id_
+        state = cls.states.pop(game_id, None)
+        if state:
+            state.flush()
+
+    def load(self):
+        """(Re)loads this state from the database"""
+        from .player import Player, Score
+        from .card import CardInstance
+        from .card_queue import PlayerCardQueue
+
+        game = self.game
+        self.players = {
+            player.id_: player
+            for player in Player.select().where(Player.game == game)
+        }
+        self.tgb = game.tgb
+        self.topics = list(game.affinitytopic_set)
+        self.colors = list(game.color_set)
+
+        # The whole score table of a game is read in one go
+        self.scores = {player_id: {} for player_id in self.players}
+        for score in Score.select().where(Score.game == game):
+            self.scores.setdefault(score.player_id, {}).setdefault(score.type, {})[
+                score.target
+            ] = score.value
+
+        self.queues = {player_id: deque() for player_id in self.players}
+        self.card_instances = {}
+        items = (
+            PlayerCardQueue.select(PlayerCardQueue, CardInstance)
+            .join(CardInstance)
+            .where(PlayerCardQueue.game == game)
+            .where(PlayerCardQueue.active == True)
+            .order_by(PlayerCardQueue.idx)
+        )
+        for item in items:
+            self.queues.setdefault(item.player_id, deque()).append(
+                item.card_instance.id_
+            )
+            self.card_instances[item.card_instance.id_] = item.card_instance
+        self.queue_idx = {
+            player_id: idx + 1
+            for player_id, idx in PlayerCardQueue.select(
+                PlayerCardQueue.player, peewee.fn.MAX(PlayerCardQueue.idx)
+            )
+            .where(PlayerCardQueue.game == game)
+            .group_by(PlayerCardQueue.player)
+            .tuples()
+        }
+
+        self.power_flags = {
+            player_id: player.power_flags for player_id, player in self.players.items()
+        }
+        self.powers_version = None
+
+        return self
+
+    @property
+    def deck(self):
+        """The shuffled deck of undrawn cards, built on the first draw"""
+        from .deck import Deck
+
+        if self._deck is None:
+            self._deck = Deck.load(self.game)
+        return self._deck
+
+    # Writes
+
+    def write(self, query):
+        """Runs a write query - or buffers it till the next flush if this
+        state is write-behind"""
+        if self.write_behind:
+            self._pending.append(query)
+        else:
+            query.execute()
+
+    def flush(self):
+        """Writes all buffered queries to the database in one transaction"""
+        pending, self._pending = self._pending, []
+        if not pending:
+            return
+        with db.atomic():
+            for query in pending:
+                query.execute()
+
+    def heartbeat_payload(self) -> dict:
+        """What is sent to a waiting game between about_game broadcasts.
+        Rebuilt only when the about version changed"""
+        if self._heartbeat is None or self._heartbeat["version"] != self.about_version:
+            self._heartbeat = {
+                "version": self.about_version,
+                "joined": sum(1 for player in self.players.values() if player.name),
+                "player_count": len(self.players),
+            }
+        return self._heartbeat
+
+    # Players
+
+    def player_summary(self, player_id: str):
+        """The id and name of a player, as other objects refer to them in
+        client payloads"""
+        if player_id is None:
+            return None
+        player = self.players.get(player_id)
+        return {"id_": player_id, "name": player.name if player else None}
+
+    def ordered_players(self):
+        """Players in their turn order"""
+        return sorted(self.players.values(), key=lambda player: player.sequence)
+
+    def get_player_by_name(self, player_name: str):
+        player_name = player_name.strip().lower()
+        for player in self.players.values():
+            if player.name and player.name.lower() == player_name:
+                return player
+
+    def update_player(self, player):
+        """Picks up the name and client of a player which were changed and
+        saved outside this state (eg. while joining a game)"""
+        if cached := self.players.get(player.id_):
+            cached.name = player.name
+            cached.client_id = player.client_id
+        else:
+            self.players[player.id_] = player
+        self.scores.setdefault(player.id_, {})
+        self.queues.setdefault(player.id_, deque())
+        self.power_flags.setdefault(player.id_, player.power_flags)
+
+    def set_current(self, player_id: str, exclusive: bool = True):
+        """Makes a player the drawing player and sends them to the back of
+        the turn order. If exclusive, all other players stop being current"""
+        from .player import Player
+
+        if exclusive:
+            for player in self.players.values():
+                player.current = False
+            self.write(
+                Player.update(current=False).where(Player.game == self.game)
+            )
+        player = self.players[player_id]
+        player.sequence += 100
+        player.current = True
+        self.write(
+            Player.update(sequence=Player.sequence + 100, current=True).where(
+                Player.id_ == player_id
+            )
+        )
+
+    # Scores
+
+    def score(self, player_id: str, type_: str, target: str = None) -> int:
+        return self.scores.get(player_id, {}).get(type_, {}).get(target, 0)
+
+    def scores_of_type(self, player_id: str, type_: str) -> dict:
+        """Returns {target: value} of all scores of a type"""
+        return dict(self.scores.get(player_id, {}).get(type_, {}))
+
+    def add_score(self, player_id: str, type_: str, target: str = None):
+        """Records a newly initialized score"""
+        self.scores.setdefault(player_id, {}).setdefault(type_, {})[target] = 0
+        self.scores_version += 1
+
+    def inc_score(
+        self, player_id: str, type_: str, target: str, inc: int, minimum: int = None
+    ):
+        """Increments a score, both here and in the database. Scores that
+        were never initialized are ignored, just like an UPDATE on a missing
+        row.
+
+        The new value is written as is rather than as `value + inc`, so the
+        row always ends up with exactly what this state holds."""
+        from .player import Score
+
+        scores = self.scores.get(player_id, {}).get(type_, {})
+        if target not in scores:
+            return
+        value = scores[target] + inc
+        if minimum is not None and value < minimum:
+            value = minimum
+        if value == scores[target]:
+            return
+
+        self.write(
+            Score.update({Score.value: value})
+            .where(Score.game == self.game)
+            .where(Score.player == player_id)
+            .where(Score.type == type_)
+            .where(Score.target.is_null() if target is None else Score.target == target)
+        )
+        # Only updated once the write went through (or was buffered)
+        self._inc_tgb(type_, value - scores[target])
+        scores[target] = value
+        self.scores_version += 1
+
+    def _inc_tgb(self, type_: str, inc: int):
+        """Every change to a bias score changes the total global bias"""
+        from .base import Game
+        from .player import ScoreType
+
+        if type_ != ScoreType.BIAS.value or not inc:
+            return
+        tgb = self.tgb + inc
+        self.write(Game.update(tgb=tgb).where(Game.id_ == self.game.id_))
+        self.tgb = self.game.tgb = tgb
+
+    # Card queues
+
+    def queue_head(self, player_id: str):
+        """Returns the oldest card instance queued for a player, or None"""
+        queue = self.queues.get(player_id)
+        if queue:
+            return self.card_instances[queue[0]]
+
+    def enqueue(self, card_instance) -> int:
+        """Queues a card instance and returns its idx in the player's queue"""
+        player_id = card_instance.player_id
+        idx = self.queue_idx.get(player_id, 0)
+        self.queue_idx[player_id] = idx + 1
+        self.queues.setdefault(player_id, deque()).append(card_instance.id_)
+        self.card_instances[card_instance.id_] = card_instance
+        return idx
+
+    def dequeue(self, card_instance):
+        queue = self.queues.get(card_instance.player_id)
+        if queue and card_instance.id_ in queue:
+            queue.remove(card_instance.id_)
+        self.card_instances.pop(card_instance.id_, None)
+
+    def dequeue_card(self, card_id: str):
+        """Removes every queued instance of a card from all queues"""
+        for card_instance in list(self.card_instances.values()):
+            if card_instance.card_id == card_id:
+                self.dequeue(card_instance)
+
+    def cache_card_instance(self, card_instance):
+        """Refreshes the cached copy of a queued card instance after it
+        changed (eg. after it was turned into fake news)"""
+        if card_instance.id_ in self.card_instances:
+            self.card_instances[card_instance.id_] = card_instance
+
+    # Card payloads
+
+    def forget_card_payload(self, card_id: str):
+        if card_id is not None:
+            self.card_payloads.pop(card_id, None)
+
+    # Card holders
+
+    def card_holders(self, card_id: str, clone: int) -> set:
+        """Returns the ids of the players who got an instance of a card"""
+        from .card import CardInstance
+
+        key = (card_id, clone)
+        if key not in self.holders:
+            self.holders[key] = {
+                player_id
+                for (player_id,) in CardInstance.select(CardInstance.player)
+                .where(CardInstance.card == card_id)
+                .where(CardInstance.clone == clone)
+                .tuples()
+            }
+        return self.holders[key]
+
+    def add_card_holder(self, card_id: str, clone: int, player_id: str):
+        # Cards nobody asked about yet are read in full when they are
+        if (holders := self.holders.get((card_id, clone))) is not None:
+            holders.add(player_id)
+
+    def remove_card_holder(self, card_id: str, clone: int, player_id: str):
+        """The player's instance of a card now is of another card (eg. it was
+        turned into fake news)"""
+        if (holders := self.holders.get((card_id, clone))) is not None:
+            holders.discard(player_id)
+
+    # Powers
+
+    def power(self, player_id: str, name: str) -> bool:
+        """Returns whether the player has a power"""
+        from .powers import POWER_FLAGS
+
+        return bool(self.power_flags.get(player_id, 0) & POWER_FLAGS[name])
+
+    def set_power(self, player_id: str, name: str, active: bool):
+        from .player import Player
+        from .powers import POWER_FLAGS
+
+        flags = self.power_flags.get(player_id, 0)
+        if active:
+            flags |= POWER_FLAGS[name]
+        else:
+            flags &= ~POWER_FLAGS[name]
+        self.power_flags[player_id] = self.players[player_id].power_flags = flags
+        self.write(Player.update(power_flags=flags).where(Player.id_ == player_id))
@@ -0,0 +1,71 @@
+"""Counts the queries (and time) taken by Game.about() for games of different
+sizes. The query count must not depend on the number of players.
+
+Run from the repo root (after `source activate_env.sh`) against a database
+set up with `python setup.py`:
+
+    PLAYER_COUNTS=2,4,8 python scripts/benchmark_about.py
+"""
+
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+from models import Game, GameState, Score, db
+
+PLAYER_COUNTS = [int(x) for x in os.getenv("PLAYER_COUNTS", "2,4,6,8").split(",")]
+REPEAT = int(os.getenv("REPEAT", "20"))
+
+
+def new_game(player_count):
+    for progress in Game.new(
+        player_count=player_count,
+        colors_filepath="config_jsons/example1/colors.json",
+        topics_filepath="config_jsons/example1/topics.json",
+        password="benchmark",
+        draw_fn_name="first",
+        cards_filepath="config_jsons/example1/cards.json",
+        encyclopedia_filepath="config_jsons/example1/articles.json",
+    ):
+        if progress["type"] == "result":
+            game = progress["payload"]
+
+    for idx in range(player_count):
+        player = game.get_unclaimed_player()
+        player.name = f"player{idx}"
+        Score.initialize(game, player)
+        player.save()
+        game.state.update_player(player)
+    return game
+
+
+def main():
+    rows = []
+    for player_count in PLAYER_COUNTS:
+        game = new_game(player_count)
+        # Cold - the state is loaded from the database first
+        GameState.unload(game)
+        with db.count_queries(SimpleNamespace(queries=0)) as cold:
+            game.about()
+
+        # Warm - every broadcast after the first one
+        with db.count_queries(SimpleNamespace(queries=0)) as warm:
+            start = time.perf_counter()
+            for _ in range(REPEAT):
+                game.about()
+            elapsed = (time.perf_counter() - start) / REPEAT
+        rows.append((player_count, cold.queries, warm.queries // REPEAT, elapsed))
+        GameState.unload(game)
+
+    print("players  cold queries  warm queries  warm ms")
+    for player_count, cold, warm, elapsed in rows:
+        print(f"{player_count:7d}  {cold:12d}  {warm:12d}  {elapsed * 1000:7.2f}")
+
+    if len({cold for _, cold, _, _ in rows}) > 1 or len({warm for _, _, warm, _ in rows}) > 1:
+        print("Query count depends on the number of players")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
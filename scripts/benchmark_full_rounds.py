@@ -0,0 +1,72 @@
+"""Times FullRound.next() / previous() with a large round history. Fills the
+database with COUNT full rounds spread over GAMES scratch games first, unless
+there are already that many.
+
+Run from the repo root (after `source activate_env.sh`) against a database
+set up with `python setup.py`:
+
+    COUNT=1000000 GAMES=1000 python scripts/benchmark_full_rounds.py
+"""
+
+import datetime
+import os
+import random
+import time
+import uuid
+
+from models import FullRound, Game, db
+from constants import IMPORT_BATCH_SIZE
+
+COUNT = int(os.getenv("COUNT", "1000000"))
+GAMES = int(os.getenv("GAMES", "1000"))
+REPEAT = int(os.getenv("REPEAT", "100"))
+
+
+def fill():
+    missing = COUNT - FullRound.select().count()
+    if missing <= 0:
+        return
+    per_game = max(missing // GAMES, 1)
+    start = datetime.datetime(2020, 1, 1)
+    print(f"Inserting {per_game * GAMES} full rounds")
+    for _ in range(GAMES):
+        game = Game.create(
+            name=f"benchmark-{uuid.uuid4().hex[:12]}",
+            draw_fn_name="",
+            password=uuid.uuid4().hex,
+            ended=True,
+        )
+        rows = [
+            {
+                "id_": uuid.uuid4().hex,
+                "game": game.id_,
+                "sequence": idx + 1,
+                "created_at": start + datetime.timedelta(seconds=idx),
+                "updated_at": start + datetime.timedelta(seconds=idx),
+            }
+            for idx in range(per_game)
+        ]
+        with db.atomic():
+            for batch in range(0, len(rows), IMPORT_BATCH_SIZE * 10):
+                FullRound.insert_many(
+                    rows[batch : batch + IMPORT_BATCH_SIZE * 10]
+                ).execute()
+
+
+def main():
+    fill()
+    full_rounds = list(
+        FullRound.select().where(FullRound.sequence.is_null(False)).limit(REPEAT * 10)
+    )
+    sample = random.sample(full_rounds, min(REPEAT, len(full_rounds)))
+
+    for name in ["next", "previous"]:
+        start = time.perf_counter()
+        for full_round in sample:
+            getattr(full_round, name)()
+        elapsed = (time.perf_counter() - start) / len(sample)
+        print(f"{name:8s} {elapsed * 1000:7.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""Times the import of a cards file (Card.import_from_json) and counts the
+queries it runs. Every run imports into a scratch game, which is deleted
+afterwards.
+
+Run from the repo root (after `source activate_env.sh`) against a database
+set up with `python setup.py`:
+
+    CARDS=config_jsons/example1/cards.json REPEAT=5 python scripts/benchmark_import.py
+"""
+
+import json
+import os
+import time
+import uuid
+from types import SimpleNamespace
+
+from models import AffinityTopic, Card, Color, Game, db
+
+CARDS = os.getenv("CARDS", "config_jsons/example1/cards.json")
+REPEAT = int(os.getenv("REPEAT", "5"))
+
+
+def scratch_game(cards):
+    """Creates a game with every topic and color the cards refer to"""
+    game = Game.create(
+        name=f"benchmark-{uuid.uuid4().hex[:12]}",
+        draw_fn_name="",
+        password=uuid.uuid4().hex,
+        ended=True,
+    )
+    topics, colors = set(), set()
+    for card in cards:
+        for card_or_fake in [card] + card.get("fakes", []):
+            if card_or_fake.get("affinity_towards"):
+                topics.add(card_or_fake["affinity_towards"])
+            if card_or_fake.get("bias_against"):
+                colors.add(card_or_fake["bias_against"])
+    for topic in topics:
+        AffinityTopic.create(name=topic, game=game)
+    for color in colors:
+        Color.create(name=color, game=game)
+    return game
+
+
+def delete_game(game):
+    with db.atomic():
+        # Fakes first - they refer to their originals
+        Card.delete().where(Card.game == game).where(Card.original.is_null(False)).execute()
+        Card.delete().where(Card.game == game).execute()
+        Color.delete().where(Color.game == game).execute()
+        AffinityTopic.delete().where(AffinityTopic.game == game).execute()
+        game.delete_instance()
+
+
+def main():
+    print(" run   cards  queries       ms")
+    for run in range(REPEAT):
+        # The importer consumes the dicts it is given
+        with open(CARDS) as infile:
+            cards = json.load(infile)
+        game = scratch_game(cards)
+        try:
+            with db.count_queries(SimpleNamespace(queries=0)) as counter:
+                start = time.perf_counter()
+                Card.import_from_json(json_dict=cards, defaults={"game_id": game.id_})
+                elapsed = time.perf_counter() - start
+            count = Card.select().where(Card.game == game).count()
+            print(f"{run:4d}  {count:6d}  {counter.queries:7d}  {elapsed * 1000:7.1f}")
+        finally:
+            delete_game(game)
+
+
+if __name__ == "__main__":
+    main()
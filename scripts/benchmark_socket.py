@@ -0,0 +1,108 @@
+"""Load test for a running server - to compare the eventlet server
+(main_loop/websocket.py) with the asyncio one (main_loop/asgi.py).
+
+Opens CLIENTS socket.io connections (long-polling, so that nothing but the
+standard library is needed) and has each of them send REQUESTS `EVENT`
+requests about GAME, one after the other. Prints the throughput and the
+latency percentiles of the replies.
+
+Start either server, create a game and then run from the repo root:
+
+    URL=http://localhost:5000 GAME=happy-cat-0042 CLIENTS=50 REQUESTS=20 \\
+        python scripts/benchmark_socket.py
+"""
+
+import json
+import os
+import threading
+import time
+import urllib.request
+
+URL = os.getenv("URL", "http://localhost:5000")
+GAME = os.getenv("GAME")
+EVENT = os.getenv("EVENT", "about_game")
+CLIENTS = int(os.getenv("CLIENTS", "20"))
+REQUESTS = int(os.getenv("REQUESTS", "20"))
+
+# engine.io packets in a polling payload are separated by this
+SEPARATOR = "\x1e"
+
+
+class PollingClient:
+    """Bare socket.io client over engine.io long-polling"""
+
+    def __init__(self, url: str):
+        self.url = url
+        opened = self._get(f"{url}/socket.io/?EIO=4&transport=polling")
+        self.sid = json.loads(opened[1:])["sid"]
+        self.endpoint = f"{url}/socket.io/?EIO=4&transport=polling&sid={self.sid}"
+        self._post("40")
+        self.receive()  # The connect reply
+        self.ack_id = 0
+
+    def _get(self, url):
+        return urllib.request.urlopen(url).read().decode()
+
+    def _post(self, body: str):
+        request = urllib.request.Request(self.endpoint, data=body.encode(), method="POST")
+        urllib.request.urlopen(request).read()
+
+    def receive(self):
+        return self._get(self.endpoint).split(SEPARATOR)
+
+    def call(self, event: str, data):
+        """Sends an event and waits for its reply"""
+        self.ack_id += 1
+        reply = f"43{self.ack_id}["
+        self._post(f"42{self.ack_id}{json.dumps([event, data])}")
+        while True:
+            for packet in self.receive():
+                if packet == "2":  # engine.io ping
+                    self._post("3")
+                if packet.startswith(reply):
+                    return json.loads(packet[len(reply) - 1 :])
+
+    def close(self):
+        self._post("41")
+
+
+def run_client(latencies, errors):
+    try:
+        client = PollingClient(URL)
+        for _ in range(REQUESTS):
+            start = time.perf_counter()
+            client.call(EVENT, {"game": GAME})
+            latencies.append(time.perf_counter() - start)
+        client.close()
+    except Exception as exc:
+        errors.append(exc)
+
+
+def percentile(values, fraction):
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def main():
+    latencies, errors = [], []
+    threads = [
+        threading.Thread(target=run_client, args=(latencies, errors))
+        for _ in range(CLIENTS)
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    print(f"{len(latencies)} replies in {elapsed:.1f}s, {len(errors)} clients failed")
+    if latencies:
+        print(f"throughput  {len(latencies) / elapsed:8.1f} req/s")
+        for name, fraction in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99)):
+            print(f"{name}         {percentile(latencies, fraction) * 1000:8.1f} ms")
+        print(f"max         {latencies[-1] * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
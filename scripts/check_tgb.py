@@ -0,0 +1,29 @@
+"""Verifies the stored total global bias (Game.tgb) of games against their
+score table. Set REBUILD=yes to overwrite counters that are off - eg. for
+games created before the counter existed.
+
+Checks all games, or only the game named in the GAME environment variable:
+
+    GAME=happy-cat-0042 REBUILD=yes python scripts/check_tgb.py
+"""
+
+import os
+
+from models import Game
+
+GAME_NAME = os.getenv("GAME")
+REBUILD = os.getenv("REBUILD", "no") == "yes"
+
+games = Game.select()
+if GAME_NAME:
+    games = games.where(Game.name == GAME_NAME)
+
+mismatched = 0
+for game in games:
+    stored, recomputed = game.check_total_global_bias(rebuild=REBUILD)
+    if stored != recomputed:
+        mismatched += 1
+        print(f"{game.name}: stored {stored}, recomputed {recomputed}")
+
+action = "rebuilt" if REBUILD else "mismatched"
+print(f"{mismatched} {action} of {games.count()} games")
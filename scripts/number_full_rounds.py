@@ -0,0 +1,38 @@
+"""Numbers the full rounds of games which were played before full rounds
+had a sequence number, in the order they were created. Run it once after
+migrating a database with existing games:
+
+    python scripts/number_full_rounds.py
+
+Games that were in progress during the migration have new rounds numbered
+from 1 already, before their older ones. Every round of such a game is
+numbered again, so that the sequence follows the order of creation.
+"""
+
+from models import FullRound, db
+
+games = (
+    FullRound.select(FullRound.game)
+    .where(FullRound.sequence.is_null())
+    .distinct()
+)
+
+numbered = 0
+for row in games:
+    with db.atomic():
+        full_rounds = list(
+            FullRound.select(FullRound.id_)
+            .where(FullRound.game == row.game_id)
+            .order_by(FullRound.created_at, FullRound.id_)
+        )
+        # Cleared first - (game, sequence) is unique, and NULLs don't collide
+        FullRound.update(sequence=None).where(
+            FullRound.game == row.game_id
+        ).execute()
+        for idx, full_round in enumerate(full_rounds, start=1):
+            FullRound.update(sequence=idx).where(
+                FullRound.id_ == full_round.id_
+            ).execute()
+            numbered += 1
+
+print(f"Numbered {numbered} full rounds")
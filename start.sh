@@ -1,6 +1,24 @@
 echo "Starting viral spiral backend"
 source activate_env.sh
-pipenv run python main_loop/websocket.py
+# Set WORKER_COUNT to run several workers, on consecutive ports from PORT.
+# They need a shared MESSAGE_QUEUE (see main_loop/cluster.py)
+WORKER_COUNT=${WORKER_COUNT:-1}
+if [ "$WORKER_COUNT" -gt 1 ]; then
+    BASE_PORT=${PORT:-5000}
+    WORKER_HOST=${WORKER_HOST:-http://localhost}
+    WORKERS=""
+    for i in $(seq 0 $((WORKER_COUNT - 1))); do
+        WORKERS="$WORKERS${WORKERS:+,}$WORKER_HOST:$((BASE_PORT + i))"
+    done
+    export WORKERS
+    for i in $(seq 0 $((WORKER_COUNT - 1))); do
+        PORT=$((BASE_PORT + i)) WORKER_ID="$WORKER_HOST:$((BASE_PORT + i))" \
+            pipenv run python main_loop/websocket.py &
+    done
+    wait
+else
+    pipenv run python main_loop/websocket.py
+fi
 # pipenv run gunicorn -b 0.0.0.0:5000 -k geventwebsocket.gunicorn.workers.GeventWebSocketWorker -w 1 --threads 10 main_loop.websocket:app
 # pipenv run gunicorn -b 0.0.0.0:5000 -w 1 --threads 100 main_loop.websocket:app
 # pipenv run gunicorn -b 0.0.0.0:5000 --worker-class eventlet --threads 100 main_loop.websocket:app
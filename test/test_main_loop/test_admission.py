@@ -0,0 +1,37 @@
+import unittest
+
+from main_loop.admission import AdmissionController, Overloaded
+
+
+class TestAdmissionController(unittest.TestCase):
+    def test_max_games(self):
+        admission = AdmissionController(max_games=2)
+        admission.admit()
+        admission.start("first", reserved=True)
+        admission.admit()
+        admission.start("second", reserved=True)
+        with self.assertRaises(Overloaded):
+            admission.admit()
+
+        admission.stop("first")
+        admission.admit()
+        self.assertEqual(admission.reserved, 1)
+
+    def test_cpu_budget(self):
+        admission = AdmissionController(cpu_budget=0.5)
+        meter = admission.start("busy")
+        meter.cpu.add(meter.cpu.window)  # A whole core
+        with self.assertRaises(Overloaded):
+            admission.admit()
+
+    def test_first_game_is_always_admitted(self):
+        admission = AdmissionController(cpu_budget=0, query_budget=0)
+        admission.admit()
+        self.assertEqual(admission.reserved, 1)
+
+    def test_cancel(self):
+        admission = AdmissionController(max_games=1)
+        admission.admit()
+        admission.cancel()
+        admission.admit()
+        self.assertEqual(admission.reserved, 1)
@@ -0,0 +1,59 @@
+import unittest
+from uuid import uuid4
+
+from main_loop.cluster import HashRing, LocalManager, check_config
+
+
+class TestHashRing(unittest.TestCase):
+    def setUp(self):
+        self.names = [uuid4().hex for _ in range(2000)]
+
+    def test_owner_is_stable(self):
+        ring = HashRing(["a", "b", "c"])
+        other = HashRing(["c", "a", "b"])
+        for name in self.names:
+            self.assertEqual(ring.owner(name), other.owner(name))
+
+    def test_no_workers(self):
+        self.assertIsNone(HashRing([]).owner("game"))
+
+    def test_spread(self):
+        ring = HashRing(["a", "b", "c", "d"])
+        counts = {}
+        for name in self.names:
+            counts[ring.owner(name)] = counts.get(ring.owner(name), 0) + 1
+        self.assertEqual(set(counts), {"a", "b", "c", "d"})
+        for count in counts.values():
+            self.assertGreater(count, len(self.names) / 4 * 0.6)
+
+    def test_adding_a_worker_only_moves_its_games(self):
+        ring = HashRing(["a", "b", "c"])
+        bigger = HashRing(["a", "b", "c", "d"])
+        for name in self.names:
+            if bigger.owner(name) != "d":
+                self.assertEqual(ring.owner(name), bigger.owner(name))
+
+
+class TestCheckConfig(unittest.TestCase):
+    def test_single_worker(self):
+        check_config([], None)
+
+    def test_worker_in_workers(self):
+        check_config(["a", "b"], "b")
+
+    def test_worker_not_in_workers(self):
+        with self.assertRaises(ValueError):
+            check_config(["a", "b"], "c")
+
+
+class TestLocalManager(unittest.TestCase):
+    def test_publish_reaches_every_subscriber(self):
+        channel = uuid4().hex
+        first = LocalManager(channel=channel)
+        second = LocalManager(channel=channel)
+        writer = LocalManager(channel=channel, write_only=True)
+
+        writer._publish({"method": "emit", "event": "foo"})
+        for manager in (first, second):
+            self.assertEqual(next(manager._listen())["event"], "foo")
+        self.assertTrue(writer.queue.empty())
@@ -0,0 +1,106 @@
+import unittest
+from unittest import mock
+
+from models import AffinityTopic, Color, Game, GameState, Player
+from models.base import about_changes
+
+
+class TestAboutChanges(unittest.TestCase):
+    def about(self, tgb=0, score=0):
+        return {
+            "total_global_bias": tgb,
+            "players": [{"id_": "p0", "name": "player", "score": score}],
+        }
+
+    def test_nothing_changed(self):
+        self.assertEqual(about_changes(self.about(), self.about()), {})
+
+    def test_changed_fields(self):
+        changes = about_changes(self.about(), self.about(tgb=2, score=3))
+        self.assertEqual(changes, {"total_global_bias": 2, "players": {"p0": {"score": 3}}})
+
+    def test_new_player(self):
+        new = self.about()
+        new["players"].append({"id_": "p1", "name": "new", "score": 0})
+        changes = about_changes(self.about(), new)
+        self.assertEqual(changes, {"players": {"p1": {"id_": "p1", "name": "new", "score": 0}}})
+
+
+class TestAboutUpdate(unittest.TestCase):
+    """about() is built from an in-memory GameState, just like in a running
+    game - only writes would go to the database, and they are buffered"""
+
+    def setUp(self):
+        self.game = Game(name="test-game", draw_fn_name="first", password="x")
+        state = GameState(self.game)
+        state.write_behind = True
+        state.colors = [Color(name=name, game=self.game) for name in ("red", "blue")]
+        state.topics = [AffinityTopic(name="cats", game=self.game)]
+        self.players = [
+            Player(name=f"player {idx}", color=color, game=self.game, sequence=idx)
+            for idx, color in enumerate(state.colors)
+        ]
+        state.players = {player.id_: player for player in self.players}
+        for player in self.players:
+            state.scores[player.id_] = {
+                "clout": {None: 0},
+                "affinity": {state.topics[0].id_: 0},
+                "bias": {color.id_: 0 for color in state.colors},
+            }
+        self.state = GameState.states[self.game.id_] = state
+
+    def tearDown(self):
+        GameState.states.pop(self.game.id_, None)
+
+    def test_versions(self):
+        event, first = self.game.about_update()
+        self.assertEqual(event, "about_game")
+        self.assertEqual(len(first["players"]), 2)
+
+        # Nothing changed - nothing is sent and the version stays
+        self.assertIsNone(self.game.about_update())
+        self.assertEqual(self.state.about_version, first["version"])
+
+        self.state.inc_score(self.players[0].id_, "clout", None, 1)
+        event, delta = self.game.about_update()
+        self.assertEqual(event, "about_game_delta")
+        self.assertEqual(delta["version"], first["version"] + 1)
+
+    def test_delta_of_a_bias_change(self):
+        self.game.about_update()
+        player, color = self.players[0], self.state.colors[1]
+        self.state.inc_score(player.id_, "bias", color.id_, 1)
+
+        event, delta = self.game.about_update()
+        self.assertEqual(event, "about_game_delta")
+        # Not the copies of the game (and its tgb) nested in every object
+        self.assertEqual(
+            delta["changes"],
+            {
+                "total_global_bias": 1,
+                "players": {
+                    player.id_: {"biases": {self.state.colors[0].id_: 0, color.id_: 1}}
+                },
+            },
+        )
+
+    def test_full_snapshot_interval(self):
+        self.game.about_update()
+        self.state.about_sent_at -= 3600
+        self.state.inc_score(self.players[0].id_, "clout", None, 1)
+        event, data = self.game.about_update()
+        self.assertEqual(event, "about_game")
+        self.assertEqual(data["players"][0]["score"], 1)
+        # The full document still has the game in its nested objects
+        self.assertEqual(data["players"][0]["game"]["name"], "test-game")
+
+    def test_versions_grow_across_reloads(self):
+        # Versions start from the wall clock in milliseconds
+        with mock.patch("models.state.time.time_ns", return_value=1_000 * 10**9):
+            state = GameState(self.game)
+        with mock.patch("models.state.time.time_ns", return_value=1_001 * 10**9):
+            reloaded = GameState(self.game)
+        self.assertEqual(state.about_version, 1_000_000)
+        # A game loaded again a second later carries on above the last 999
+        # versions sent before
+        self.assertGreater(reloaded.about_version, state.about_version + 999)
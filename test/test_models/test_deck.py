@@ -0,0 +1,106 @@
+import random
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from models.card import Card
+from models.deck import (
+    BIAS,
+    FAKE_AFFINITY,
+    FAKE_TOPICAL,
+    TRUE_AFFINITY,
+    TRUE_TOPICAL,
+    Deck,
+)
+
+
+def card(id_, bias_against=None, affinity_towards=None, fake=False, tgb=0):
+    return SimpleNamespace(
+        id_=id_,
+        bias_against_id=bias_against,
+        affinity_towards_id=affinity_towards,
+        fake=fake,
+        tgb=tgb,
+    )
+
+
+class TestDeck(unittest.TestCase):
+    def test_category(self):
+        self.assertEqual(Deck.category(card("a")), TRUE_TOPICAL)
+        self.assertEqual(Deck.category(card("a", fake=True)), FAKE_TOPICAL)
+        self.assertEqual(Deck.category(card("a", affinity_towards="cats")), TRUE_AFFINITY)
+        self.assertEqual(
+            Deck.category(card("a", affinity_towards="cats", fake=True)), FAKE_AFFINITY
+        )
+        # Bias cards are bias cards, whatever else they are
+        self.assertEqual(
+            Deck.category(card("a", bias_against="red", affinity_towards="cats")), BIAS
+        )
+
+    def test_count(self):
+        deck = Deck(
+            [
+                card("a", bias_against="red", tgb=0),
+                card("b", bias_against="red", tgb=5),
+                card("c", bias_against="blue", tgb=0),
+                card("d", bias_against="blue", tgb=None),
+            ]
+        )
+        self.assertEqual(deck.count(BIAS), 4)
+        # Cards without a tgb never pass a tgb threshold
+        self.assertEqual(deck.count(BIAS, max_tgb=5), 3)
+        self.assertEqual(deck.count(BIAS, max_tgb=0), 2)
+        self.assertEqual(deck.count(BIAS, max_tgb=0, exclude_colors={"red"}), 1)
+        self.assertEqual(deck.count(TRUE_TOPICAL), 0)
+
+    def test_buckets_are_weighed_by_size(self):
+        deck = Deck([card("a", tgb=0)] + [card(str(idx), tgb=1) for idx in range(3)])
+        with mock.patch("models.deck.random.choices", wraps=random.choices) as choices:
+            deck.pop(TRUE_TOPICAL)
+        self.assertEqual(sorted(choices.call_args.kwargs["weights"]), [1, 3])
+
+    def test_pop_until_exhausted(self):
+        ids = {str(idx) for idx in range(10)}
+        deck = Deck([card(id_, tgb=idx % 3) for idx, id_ in enumerate(sorted(ids))])
+        popped = set()
+        while (card_id := deck.pop(TRUE_TOPICAL)) is not None:
+            popped.add(card_id)
+        self.assertEqual(popped, ids)
+        self.assertEqual(deck.count(TRUE_TOPICAL), 0)
+        self.assertIsNone(deck.pop(TRUE_TOPICAL))
+
+    def test_pop_respects_filters(self):
+        deck = Deck(
+            [
+                card("red", bias_against="red", tgb=0),
+                card("high", bias_against="blue", tgb=9),
+                card("blue", bias_against="blue", tgb=0),
+            ]
+        )
+        self.assertEqual(deck.pop(BIAS, max_tgb=1, exclude_colors={"red"}), "blue")
+        self.assertIsNone(deck.pop(BIAS, max_tgb=1, exclude_colors={"red"}))
+
+    def test_draw_skips_cards_taken_behind_its_back(self):
+        deck = Deck([card("drawn"), card("faked"), card("deleted"), card("free")])
+        rows = {
+            "drawn": SimpleNamespace(original_player_id="p", faked_by_id=None),
+            "faked": SimpleNamespace(original_player_id=None, faked_by_id="p"),
+            "deleted": None,
+            "free": SimpleNamespace(original_player_id=None, faked_by_id=None),
+        }
+        popped = []
+
+        def get_or_none(query):
+            card_id = query.rhs
+            popped.append(card_id)
+            return rows[card_id]
+
+        with mock.patch.object(Card, "get_or_none", side_effect=get_or_none):
+            drawn = deck.draw(TRUE_TOPICAL)
+            # Nothing else in the deck can be drawn
+            while deck.draw(TRUE_TOPICAL) is not None:
+                pass
+
+        self.assertIs(drawn, rows["free"])
+        self.assertEqual(sorted(popped), sorted(rows))
+        self.assertEqual(deck.count(TRUE_TOPICAL), 0)
@@ -0,0 +1,102 @@
+import unittest
+from contextlib import nullcontext
+from types import SimpleNamespace
+from unittest import mock
+
+from models import Game, GameState, db
+
+
+def card_instance(id_, player_id, card_id):
+    return SimpleNamespace(id_=id_, player_id=player_id, card_id=card_id)
+
+
+class TestGameState(unittest.TestCase):
+    def setUp(self):
+        self.state = GameState(Game(name="test-game"))
+        self.state.write_behind = True
+        self.state.scores = {
+            "p1": {"bias": {"red": 1}, "clout": {None: 0}},
+            "p2": {"bias": {"red": 0}},
+        }
+
+    def test_inc_score(self):
+        self.state.inc_score("p1", "clout", None, 2)
+        self.assertEqual(self.state.score("p1", "clout"), 2)
+        self.assertEqual(self.state.scores_version, 1)
+        self.assertEqual(len(self.state._pending), 1)
+
+    def test_inc_score_minimum(self):
+        self.state.inc_score("p1", "clout", None, -1, minimum=0)
+        # Nothing changed, so nothing is written
+        self.assertEqual(self.state.score("p1", "clout"), 0)
+        self.assertEqual(self.state.scores_version, 0)
+        self.assertEqual(self.state._pending, [])
+
+        self.state.inc_score("p1", "bias", "red", -5, minimum=0)
+        self.assertEqual(self.state.score("p1", "bias", "red"), 0)
+
+    def test_inc_score_not_initialized(self):
+        self.state.inc_score("p2", "clout", None, 1)
+        self.state.inc_score("p3", "bias", "red", 1)
+        self.assertEqual(self.state.score("p2", "clout"), 0)
+        self.assertEqual(self.state._pending, [])
+
+    def test_tgb_follows_bias_scores(self):
+        self.state.inc_score("p1", "bias", "red", 2)
+        self.state.inc_score("p2", "bias", "red", 1)
+        self.state.inc_score("p1", "clout", None, 3)
+        self.assertEqual(self.state.tgb, 3)
+        self.assertEqual(self.state.game.tgb, 3)
+
+        # Only what the minimum let through counts
+        self.state.inc_score("p1", "bias", "red", -10, minimum=0)
+        self.assertEqual(self.state.tgb, 0)
+
+    def test_enqueue(self):
+        self.state.queue_idx = {"p1": 4}  # As loaded from the database
+        first = card_instance("ci1", "p1", "c1")
+        second = card_instance("ci2", "p1", "c2")
+        other = card_instance("ci3", "p2", "c1")
+        self.assertEqual(self.state.enqueue(first), 4)
+        self.assertEqual(self.state.enqueue(second), 5)
+        self.assertEqual(self.state.enqueue(other), 0)
+        self.assertIs(self.state.queue_head("p1"), first)
+
+        self.state.dequeue(first)
+        self.assertIs(self.state.queue_head("p1"), second)
+        self.assertIsNone(self.state.queue_head("p3"))
+
+    def test_dequeue_card(self):
+        for instance in [
+            card_instance("ci1", "p1", "c1"),
+            card_instance("ci2", "p1", "c2"),
+            card_instance("ci3", "p2", "c1"),
+        ]:
+            self.state.enqueue(instance)
+        self.state.dequeue_card("c1")
+        self.assertEqual(list(self.state.queues["p1"]), ["ci2"])
+        self.assertEqual(list(self.state.queues["p2"]), [])
+        self.assertEqual(set(self.state.card_instances), {"ci2"})
+
+    def test_flush(self):
+        executed = []
+        queries = [mock.Mock(execute=lambda idx=idx: executed.append(idx)) for idx in range(3)]
+        with mock.patch.object(db, "atomic", return_value=nullcontext()) as atomic:
+            for query in queries:
+                self.state.write(query)
+            self.assertEqual(executed, [])
+
+            self.state.flush()
+            self.assertEqual(executed, [0, 1, 2])
+            self.assertEqual(self.state._pending, [])
+
+            # Nothing to write - no transaction
+            self.state.flush()
+            self.assertEqual(atomic.call_count, 1)
+
+    def test_write_through(self):
+        self.state.write_behind = False
+        query = mock.Mock()
+        self.state.write(query)
+        query.execute.assert_called_once_with()
+        self.assertEqual(self.state._pending, [])